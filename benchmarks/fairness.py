@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from benchmarks.server import PageServer
+from domain.classes import Base, Channel, ETagMonitor, Monitor, Server, Website
+from engine.fairness import FairQueue
+from engine.processing import UpdateProcessor
+from network.fetcher import AsyncFetcher, HOST_WAIT
+from persistence.blobs import BlobStore
+
+
+def build(server: PageServer, large: int, small_guilds: int, small: int, hosts: int) -> Base:
+    # Guild 1 has `large` websites, the others `small` each, every website on its own page
+    base = Base()
+    page = 0
+    for guild_id, count in [(1, large), *((guild_id, small) for guild_id in range(2, small_guilds + 2))]:
+        guild = Server(guild_id)
+        channel = Channel(guild_id, guild)
+        for index in range(count):
+            url = server.get_url_format().format(host=page % hosts, page=page)
+            Website(f"site-{index}", url, channel, ETagMonitor)
+            page += 1
+        base.add_server(guild)
+    return base
+
+
+async def run_cycle(monitors: list[Monitor], fetcher: AsyncFetcher, fair: FairQueue | None) -> dict[int, list[float]]:
+    # Seconds until the check of every monitor finished, by guild, with every monitor due at once
+    processor = UpdateProcessor(workers=0)
+    done: dict[int, list[float]] = {}
+    start = time.perf_counter()
+
+    async def check(monitor: Monitor):
+        if fair is None:
+            await monitor.check_update(fetcher, processor)
+        else:
+            async with fair.slot(monitor.get_server_ids()) as turn:
+                HOST_WAIT.set(lambda: fair.paused(turn))
+                await monitor.check_update(fetcher, processor)
+        for guild_id in monitor.get_server_ids():
+            done.setdefault(guild_id, []).append(time.perf_counter() - start)
+
+    await asyncio.gather(*(check(monitor) for monitor in monitors))
+    return done
+
+
+async def run(args: argparse.Namespace, folder: Path) -> dict[str, object]:
+    ETagMonitor.store = BlobStore(folder)
+    server = PageServer(hosts=args.hosts, port=args.port, body_size=args.body_size, latency=args.latency)
+    build(server, args.large, args.small_guilds, args.small, args.hosts)
+    # Largest guild first, like the servers were iterated before
+    monitors = list(Monitor.get_monitors())
+    fetcher = AsyncFetcher(concurrency=args.concurrency, host_concurrency=args.host_concurrency, host_spacing=0)
+    report: dict[str, object] = {}
+    await server.start()
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            # Baselines first, so both runs below only revalidate
+            await run_cycle(monitors, fetcher, None)
+            for name, fair in (
+                    ("fifo", None),
+                    ("fair", FairQueue(
+                        concurrency=args.concurrency,
+                        guild_concurrency=args.guild_concurrency,
+                        latency_target=args.latency_target,
+                    )),
+            ):
+                done = await run_cycle(monitors, fetcher, fair)
+                small = [max(times) for guild_id, times in done.items() if guild_id != 1]
+                report[name] = {
+                    "large_guild_s": max(done[1]),
+                    "small_guilds_mean_s": sum(small) / len(small),
+                    "small_guilds_max_s": max(small),
+                }
+    finally:
+        await server.stop()
+        await fetcher.close()
+    return report
+
+
+def print_report(report: dict[str, object]):
+    for name, result in report.items():
+        print(
+            f"{name + ':':<6} last check of the large guild after {result['large_guild_s']:.2f}s, "
+            f"small guilds done after {result['small_guilds_mean_s']:.2f}s on average, {result['small_guilds_max_s']:.2f}s at most"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time until small guilds are checked next to a large one, with and without fair queuing")
+    parser.add_argument("--large", type=int, default=2000, help="websites of the large guild")
+    parser.add_argument("--small-guilds", type=int, default=20)
+    parser.add_argument("--small", type=int, default=5, help="websites of every small guild")
+    parser.add_argument("--hosts", type=int, default=10)
+    parser.add_argument("--body-size", type=int, default=4 * 1024, help="bytes per page")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the server waits before answering")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--host-concurrency", type=int, default=20)
+    parser.add_argument("--guild-concurrency", type=int, default=0, help="checks a guild can run at once, 0 is no limit")
+    parser.add_argument("--latency-target", type=float, default=30)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON, to compare runs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        report = asyncio.run(run(args, Path(folder)))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
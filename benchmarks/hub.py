@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import asyncio
+import secrets
+import time
+import aiohttp
+from aiohttp import web
+from network.websub import sign
+
+
+class LocalHub:
+    # Local stand-in for a WebSub hub: subscriptions are verified with the subscriber like a real hub does,
+    # publish() sends every verified subscriber of the topic a signed notification
+    def __init__(self, port: int = 8766) -> None:
+        self._port = port
+        # topic -> callback -> (secret, lease end)
+        self._subscriptions: dict[str, dict[str, tuple[str | None, float]]] = {}
+        self._runner: web.AppRunner | None = None
+        self._session: aiohttp.ClientSession | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self.requests = 0
+        self.verified = 0
+        self.delivered = 0
+
+    def get_url(self) -> str:
+        return f"http://127.0.0.1:{self._port}/"
+
+    def get_subscriber_count(self, topic: str) -> int:
+        return len(self._subscriptions.get(topic, {}))
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        form = await request.post()
+        mode, topic, callback = form.get("hub.mode"), form.get("hub.topic"), form.get("hub.callback")
+        if mode not in ("subscribe", "unsubscribe") or not topic or not callback:
+            return web.Response(status=400)
+        task = asyncio.create_task(self.verify(
+            str(mode), str(topic), str(callback), form.get("hub.secret"), float(form.get("hub.lease_seconds", 3600)),
+        ))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        # Accepted, the subscription is only made once the subscriber confirms it
+        return web.Response(status=202)
+
+    async def verify(self, mode: str, topic: str, callback: str, secret: str | None, lease: float):
+        challenge = secrets.token_hex(8)
+        params = {"hub.mode": mode, "hub.topic": topic, "hub.challenge": challenge, "hub.lease_seconds": str(int(lease))}
+        async with self._session.get(callback, params=params) as res:
+            if res.status // 100 != 2 or await res.text() != challenge:
+                return
+        subscribers = self._subscriptions.setdefault(topic, {})
+        if mode == "subscribe":
+            subscribers[callback] = (secret, time.time() + lease)
+            self.verified += 1
+        else:
+            subscribers.pop(callback, None)
+
+    async def publish(self, topic: str, body: bytes = b"<feed/>"):
+        now = time.time()
+        for callback, (secret, until) in list(self._subscriptions.get(topic, {}).items()):
+            if until < now:
+                continue
+            headers = {"Content-Type": "application/atom+xml"}
+            if secret:
+                headers["X-Hub-Signature"] = sign(secret, body)
+            async with self._session.post(callback, data=body, headers=headers) as res:
+                if res.status == 410:
+                    self._subscriptions[topic].pop(callback, None)
+                elif res.status // 100 == 2:
+                    self.delivered += 1
+
+    async def start(self):
+        self._session = aiohttp.ClientSession()
+        app = web.Application()
+        app.router.add_post("/", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self._port).start()
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import argparse
+import gc
+import tempfile
+import tracemalloc
+from pathlib import Path
+from benchmarks.synthetic import build_base
+from domain.classes import ETagMonitor, Monitor
+from persistence.blobs import BlobStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory used by the domain model for a synthetic deployment")
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--channels", type=int, default=5)
+    parser.add_argument("--websites", type=int, default=20, help="websites per channel")
+    parser.add_argument("--users", type=int, default=100, help="users per guild")
+    parser.add_argument("--subscriptions", type=int, default=10, help="subscriptions per user")
+    parser.add_argument("--urls", type=int, default=2000, help="distinct urls")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        ETagMonitor.data_dir = Path(folder)
+        ETagMonitor.store = BlobStore(Path(folder))
+
+        gc.collect()
+        tracemalloc.start()
+        base = build_base(args.guilds, args.channels, args.websites, args.users, args.subscriptions, args.urls)
+        gc.collect()
+        used, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    websites = base.get_website_count()
+    print(f"websites:       {websites}")
+    print(f"monitors:       {len(Monitor.get_monitors())}")
+    print(f"subscriptions:  {base.get_subscription_count()}")
+    print(f"total:          {used / 2 ** 20:.1f} MiB (peak {peak / 2 ** 20:.1f} MiB)")
+    print(f"per website:    {used / websites:.0f} B")
+
+
+if __name__ == "__main__":
+    main()
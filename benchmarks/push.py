@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from benchmarks.hub import LocalHub
+from benchmarks.server import PageServer
+from benchmarks.synthetic import build_base
+from domain.classes import ETagMonitor, Monitor, PushMonitor
+from engine.processing import UpdateProcessor
+from engine.push import PushReceiver
+from engine.scheduler import PollScheduler
+from network.fetcher import AsyncFetcher
+from persistence.blobs import BlobStore
+
+
+def use_store(folder: Path):
+    ETagMonitor.store = BlobStore(folder.joinpath("ETagMonitor"))
+    PushMonitor.store = BlobStore(folder.joinpath("PushMonitor"))
+
+
+async def wait_until(condition, timeout: float) -> bool:
+    end = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > end:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+async def run(args: argparse.Namespace, folder: Path) -> dict[str, object]:
+    report: dict[str, object] = {"mode": "poll" if args.poll else "push"}
+    use_store(folder)
+    hub = LocalHub(port=args.hub_port)
+    server = PageServer(
+        hosts=args.hosts,
+        port=args.port,
+        latency=args.latency,
+        seed=args.seed,
+        hub=None if args.poll else hub.get_url(),
+    )
+    build_base(1, 1, args.urls, 0, 0, args.urls, hosts=args.hosts, seed=args.seed,
+               monitor=ETagMonitor if args.poll else PushMonitor, url_format=server.get_url_format())
+    monitors = list(Monitor.get_monitors())
+
+    fetcher = AsyncFetcher(host_spacing=0)
+    processor = UpdateProcessor(workers=0)
+    # Polling monitors are checked every interval, push monitors slow down to the longest one
+    scheduler = PollScheduler(
+        min_interval=args.interval,
+        max_interval=args.interval if args.poll else args.max_interval,
+        jitter=0,
+    )
+    receiver = PushReceiver(
+        f"http://127.0.0.1:{args.push_port}",
+        fetcher,
+        scheduler.poke,
+        lambda monitor: None,
+        renew_every=0.1,
+    )
+    # Monitor -> when its page changed, until the change is detected
+    changed_at: dict[Monitor, float] = {}
+    latencies: list[float] = []
+    checks: set[asyncio.Task] = set()
+
+    async def check(due: list[Monitor]):
+        # Same steps as check_updates in the bot
+        results = await asyncio.gather(*(monitor.check_update(fetcher, processor) for monitor in due), return_exceptions=True)
+        for monitor, result in zip(due, results):
+            if isinstance(result, Exception):
+                scheduler.fail(monitor, result)
+                continue
+            update = monitor.is_updated()
+            scheduler.reschedule(monitor, bool(update))
+            if update and monitor in changed_at:
+                latencies.append(time.perf_counter() - changed_at.pop(monitor))
+
+    async def poll():
+        while True:
+            due = await scheduler.next_due()
+            task = asyncio.create_task(check(due))
+            checks.add(task)
+            task.add_done_callback(checks.discard)
+
+    await server.start()
+    await hub.start()
+    await receiver.start("127.0.0.1", args.push_port)
+    poller = asyncio.create_task(poll())
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for monitor in monitors:
+                scheduler.add(monitor)
+            await wait_until(lambda: all(monitor.has_baseline() for monitor in monitors), 60)
+            if not args.poll:
+                report["subscribed"] = await wait_until(lambda: receiver.get_active_count() == len(monitors), 60)
+
+            start_requests = server.requests
+            start = time.perf_counter()
+            changed = 0
+            for _ in range(args.rounds):
+                versions = {monitor: server.get_version(monitor.get_url().rsplit("/", 1)[-1]) for monitor in monitors}
+                server.churn([monitor.get_url() for monitor in monitors], args.churn)
+                now = time.perf_counter()
+                for monitor, version in versions.items():
+                    if server.get_version(monitor.get_url().rsplit("/", 1)[-1]) != version:
+                        changed_at[monitor] = now
+                        changed += 1
+                        if not args.poll:
+                            await hub.publish(monitor.get_topic())
+                await asyncio.sleep(args.wait)
+            elapsed = time.perf_counter() - start
+    finally:
+        poller.cancel()
+        await receiver.close()
+        await hub.stop()
+        await server.stop()
+        await fetcher.close()
+        processor.close()
+
+    latencies.sort()
+    report["monitors"] = len(monitors)
+    report["changed"] = changed
+    report["detected"] = len(latencies)
+    report["latency_mean_s"] = sum(latencies) / len(latencies) if latencies else None
+    report["latency_max_s"] = latencies[-1] if latencies else None
+    report["requests"] = server.requests - start_requests
+    report["requests_per_s"] = report["requests"] / elapsed
+    report["pushes"] = hub.delivered
+    return report
+
+
+def print_report(report: dict[str, object]):
+    print(f"mode:           {report['mode']}, {report['monitors']} monitors")
+    if "subscribed" in report:
+        print(f"subscribed:     {report['subscribed']}")
+    print(f"detected:       {report['detected']}/{report['changed']} changes")
+    if report["latency_mean_s"] is not None:
+        print(f"latency:        mean {report['latency_mean_s'] * 1000:.0f} ms, max {report['latency_max_s'] * 1000:.0f} ms")
+    print(f"requests:       {report['requests']} ({report['requests_per_s']:.1f}/s, {report['pushes']} pushes)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detection latency and request load of push monitors against a local hub")
+    parser.add_argument("--poll", action="store_true", help="use polling monitors without a hub, to compare")
+    parser.add_argument("--urls", type=int, default=100)
+    parser.add_argument("--hosts", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--churn", type=float, default=0.1, help="fraction of the pages changed every round")
+    parser.add_argument("--wait", type=float, default=10, help="seconds between two rounds")
+    parser.add_argument("--interval", type=float, default=5, help="polling interval, the shortest one of push monitors")
+    parser.add_argument("--max-interval", type=float, default=60, help="interval of push monitors with a subscription")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds the server waits before answering")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--hub-port", type=int, default=8766)
+    parser.add_argument("--push-port", type=int, default=8767)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON, to compare runs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        report = asyncio.run(run(args, Path(folder)))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
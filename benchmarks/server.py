@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+from aiohttp import web
+
+# Last change of the first version of every page in the sitemaps, each new version is a minute later
+SITEMAP_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class PageServer:
+    # Local stand-in for the monitored websites: every page has a version that churn() bumps,
+    # the ETag follows the version so If-None-Match gets a 304 while the page is unchanged
+    def __init__(
+            self,
+            hosts: int = 10,
+            port: int = 8765,
+            body_size: int = 20 * 1024,
+            latency: float = 0.05,
+            etags: bool = True,
+            seed: int = 0,
+            hub: str | None = None,
+            sitemap_pages: int = 0,
+    ) -> None:
+        self._hosts = hosts
+        self._port = port
+        self._body_size = body_size
+        self._latency = latency
+        self._etags = etags
+        # Announced in a Link header of every page, like a WebSub publisher does
+        self._hub = hub
+        # Pages listed, with their version as last change, in the /sitemap.xml of their host
+        self._sitemap_pages = sitemap_pages
+        self._generation = 0
+        self._rng = random.Random(seed)
+        self._versions: dict[str, int] = {}
+        self._runner: web.AppRunner | None = None
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+
+    def get_url_format(self) -> str:
+        # One loopback address per host, so the fetcher applies its per-host limits like in production
+        return f"http://127.0.{{host}}.1:{self._port}/page{{page}}.html"
+
+    def get_version(self, page: str) -> int:
+        return self._versions.get(page, 0)
+
+    def render(self, page: str) -> bytes:
+        version = self.get_version(page)
+        line = f"<p>{page} paragraph {{}} of the page, always the same</p>\n"
+        lines = ["<html><body>\n"]
+        size = 0
+        index = 0
+        while size < self._body_size:
+            lines.append(line.format(index))
+            size += len(lines[-1])
+            index += 1
+        # A change touches a single line somewhere in the middle, like a new announcement would
+        lines.insert(len(lines) // 2, f"<p>{page} version {version}</p>\n")
+        lines.append("</body></html>\n")
+        return "".join(lines).encode()
+
+    def churn(self, urls: list[str], fraction: float) -> int:
+        changed = self._rng.sample(urls, int(len(urls) * fraction))
+        for url in changed:
+            page = url.rsplit("/", 1)[-1]
+            self._versions[page] = self.get_version(page) + 1
+        self._generation += 1
+        return len(changed)
+
+    async def handle_sitemap(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        etag = f'"sitemap-{self._generation}"'
+        if self._etags and request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        # The pages of a host are the ones the synthetic url format puts on its address
+        host = int(request.host.split(".")[2])
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+        for page in range(host, self._sitemap_pages, self._hosts):
+            name = f"page{page}.html"
+            lines.append(
+                f"<url><loc>http://{request.host}/{name}</loc>"
+                f"<lastmod>{(SITEMAP_EPOCH + timedelta(minutes=self.get_version(name))).isoformat()}</lastmod></url>\n"
+            )
+        lines.append("</urlset>\n")
+        body = "".join(lines).encode()
+        self.bytes_sent += len(body)
+        headers = {"ETag": etag} if self._etags else {}
+        return web.Response(body=body, headers=headers, content_type="application/xml", charset="utf-8")
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        page = request.match_info["page"]
+        etag = f'"{page}-{self.get_version(page)}"'
+        headers = {"ETag": etag} if self._etags else {}
+        if self._hub is not None:
+            headers["Link"] = f'<{self._hub}>; rel="hub", <{request.url}>; rel="self"'
+        if self._etags and request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers=headers)
+        body = self.render(page)
+        self.bytes_sent += len(body)
+        return web.Response(body=body, headers=headers, content_type="text/html", charset="utf-8")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/sitemap.xml", self.handle_sitemap)
+        app.router.add_get("/{page}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        for host in range(self._hosts):
+            await web.TCPSite(self._runner, f"127.0.{host}.1", self._port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from benchmarks.server import PageServer
+from benchmarks.synthetic import build_base
+from domain.classes import ETagMonitor, IndexedMonitor, Monitor
+from engine.fairness import FairQueue
+from engine.notifier import NotificationDispatcher
+from engine.polling import check_batch
+from engine.processing import UpdateProcessor
+from engine.scheduler import PollScheduler
+from network.fetcher import AsyncFetcher
+from persistence.blobs import BlobStore
+from persistence.csv import CSVDomainLoader, CSVDomainSaver
+from persistence.sqlite import SQLiteDomainLoader, SQLiteDomainSaver
+
+
+def peak_memory() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def use_store(folder: Path):
+    for monitor in (ETagMonitor, IndexedMonitor):
+        monitor.data_dir = folder.joinpath(monitor.__name__)
+        monitor.store = BlobStore(monitor.data_dir)
+
+
+def timed_load(loader: str, location: str, store: str) -> tuple[float, int, float]:
+    # Runs in a fresh process, loading into a process that already has the monitors would be faster than a restart
+    use_store(Path(store))
+    start = time.perf_counter()
+    base = {"csv": CSVDomainLoader, "sqlite": SQLiteDomainLoader}[loader].load(Path(location))
+    return time.perf_counter() - start, base.get_website_count(), peak_memory()
+
+
+async def run_cycle(
+        monitors: list[Monitor],
+        fetcher: AsyncFetcher,
+        processor: UpdateProcessor,
+        scheduler: PollScheduler,
+        fair: FairQueue,
+        notifier: NotificationDispatcher,
+) -> tuple[int, int]:
+    # The batch the bot checks, with every monitor due at once, and its notifications without Discord
+    results = await check_batch(monitors, fetcher, processor, scheduler, fair, Monitor.get_server_ids)
+    updated = errors = 0
+    for monitor, result in zip(monitors, results):
+        if isinstance(result, Exception):
+            errors += 1
+            continue
+        if not result:
+            continue
+        updated += 1
+        for website in monitor.get_websites():
+            notifier.notify(website.get_channel().get_id(), f"{website.get_hyperlink()} was updated!\n", result)
+    return updated, errors
+
+
+async def run(args: argparse.Namespace, folder: Path) -> dict[str, object]:
+    report: dict[str, object] = {}
+    use_store(folder)
+    server = PageServer(
+        hosts=args.hosts,
+        port=args.port,
+        body_size=args.body_size,
+        latency=args.latency,
+        etags=not args.no_etags,
+        seed=args.seed,
+        sitemap_pages=args.urls if args.index else 0,
+    )
+
+    start = time.perf_counter()
+    base = build_base(
+        args.guilds,
+        args.channels,
+        args.websites,
+        args.users,
+        args.subscriptions,
+        args.urls,
+        hosts=args.hosts,
+        seed=args.seed,
+        url_format=server.get_url_format(),
+        monitor=IndexedMonitor if args.index else ETagMonitor,
+    )
+    report["build_s"] = time.perf_counter() - start
+    report["websites"] = base.get_website_count()
+    report["subscriptions"] = base.get_subscription_count()
+    monitors = list(Monitor.get_monitors())
+    report["monitors"] = len(monitors)
+    if args.index:
+        # Every cycle reads the sitemap of each host once, the pages it lists as unchanged are not fetched
+        IndexedMonitor.index_max_age = 0
+        for monitor in monitors:
+            monitor.set_index(monitor.get_url().rsplit("/", 1)[0] + "/sitemap.xml")
+
+    fetcher = AsyncFetcher(
+        concurrency=args.concurrency,
+        host_concurrency=args.host_concurrency,
+        host_spacing=args.host_spacing,
+    )
+    processor = UpdateProcessor(workers=args.workers)
+    # Only rescheduled like in the bot, every cycle checks all the monitors
+    scheduler = PollScheduler()
+    fair = FairQueue(concurrency=args.concurrency)
+    messages = 0
+
+    async def send(channel_id: int, content: str):
+        nonlocal messages
+        messages += 1
+
+    notifier = NotificationDispatcher(send, window=0, channel_rate=10 ** 9, global_rate=10 ** 9)
+    urls = [monitor.get_url() for monitor in monitors]
+    cycles: list[dict[str, float]] = []
+    await server.start()
+    try:
+        # The first cycle fetches every baseline, the following ones see `churn` of the pages change
+        for cycle in range(args.cycles + 1):
+            changed = server.churn(urls, args.churn) if cycle else 0
+            requests = server.requests
+            start = time.perf_counter()
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                try:
+                    updated, errors = await asyncio.wait_for(
+                        run_cycle(monitors, fetcher, processor, scheduler, fair, notifier),
+                        args.cycle_timeout,
+                    )
+                except asyncio.TimeoutError:
+                    # Checks waiting on each other never finish, a hang would not say which cycle got stuck
+                    raise RuntimeError(f"cycle {cycle} did not finish within {args.cycle_timeout}s") from None
+            elapsed = time.perf_counter() - start
+            cycles.append({
+                "cycle": cycle,
+                "seconds": elapsed,
+                "requests_per_s": (server.requests - requests) / elapsed,
+                "changed": changed,
+                "updated": updated,
+                "errors": errors,
+            })
+        await notifier.close()
+    finally:
+        await server.stop()
+        await fetcher.close()
+        processor.close()
+
+    report["cycles"] = cycles
+    report["requests"] = server.requests
+    report["not_modified"] = server.not_modified
+    report["bytes_sent"] = server.bytes_sent
+    report["messages"] = messages
+
+    csv_folder = folder.joinpath("csv")
+    csv_folder.joinpath("monitors").mkdir(parents=True)
+    database = folder.joinpath("bench.sqlite3")
+    for name, saver, location in (("csv", CSVDomainSaver, csv_folder), ("sqlite", SQLiteDomainSaver, database)):
+        start = time.perf_counter()
+        saver.save(base, location)
+        report[f"{name}_save_s"] = time.perf_counter() - start
+
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for name, location in (("csv", csv_folder), ("sqlite", database)):
+            elapsed, count, memory = pool.submit(timed_load, name, str(location), str(folder)).result()
+            report[f"{name}_load_s"] = elapsed
+            report[f"{name}_load_websites"] = count
+
+    report["peak_memory_mib"] = peak_memory()
+    return report
+
+
+def print_report(report: dict[str, object]):
+    print(f"websites:       {report['websites']} ({report['monitors']} monitors, {report['subscriptions']} subscriptions)")
+    print(f"build:          {report['build_s'] * 1000:.0f} ms")
+    for cycle in report["cycles"]:
+        print(
+            f"cycle {cycle['cycle']:<3}       {cycle['seconds'] * 1000:.0f} ms, {cycle['requests_per_s']:.0f} req/s, "
+            f"{cycle['updated']}/{cycle['changed']} updates, {cycle['errors']} errors"
+        )
+    print(f"requests:       {report['requests']} ({report['not_modified']} not modified, {report['bytes_sent'] / 2 ** 20:.1f} MiB)")
+    print(f"messages:       {report['messages']}")
+    for name in ("csv", "sqlite"):
+        print(
+            f"{name + ':':<16}save {report[f'{name}_save_s'] * 1000:.0f} ms, "
+            f"load {report[f'{name}_load_s'] * 1000:.0f} ms ({report[f'{name}_load_websites']} websites)"
+        )
+    print(f"peak memory:    {report['peak_memory_mib']:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll a synthetic deployment against a local HTTP server")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--channels", type=int, default=5)
+    parser.add_argument("--websites", type=int, default=10, help="websites per channel")
+    parser.add_argument("--users", type=int, default=50, help="users per guild")
+    parser.add_argument("--subscriptions", type=int, default=5, help="subscriptions per user")
+    parser.add_argument("--urls", type=int, default=500, help="distinct urls")
+    parser.add_argument("--hosts", type=int, default=10)
+    parser.add_argument("--cycles", type=int, default=3, help="cycles after the one fetching the baselines")
+    parser.add_argument("--churn", type=float, default=0.1, help="fraction of the pages changed before every cycle")
+    parser.add_argument("--body-size", type=int, default=20 * 1024, help="bytes per page")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds the server waits before answering")
+    parser.add_argument("--no-etags", action="store_true", help="never answer 304, like servers without validators")
+    parser.add_argument("--index", action="store_true", help="check the pages through the sitemap of their host")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--host-concurrency", type=int, default=2)
+    parser.add_argument("--host-spacing", type=float, default=0)
+    parser.add_argument("--workers", type=int, default=2, help="process pool workers, 0 processes pages inline")
+    parser.add_argument("--cycle-timeout", type=float, default=300, help="seconds after which a cycle counts as stuck")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON, to compare runs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        report = asyncio.run(run(args, Path(folder)))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import random
+from domain.classes import Base, Server, Channel, Website, User, Monitor, CHANGES
+
+
+def build_base(
+        guilds: int,
+        channels: int,
+        websites: int,
+        users: int,
+        subscriptions: int,
+        urls: int,
+        hosts: int = 10,
+        monitor: type[Monitor] | None = None,
+        seed: int = 0,
+        url_format: str = "http://host{host}.test/page{page}.html",
+) -> Base:
+    # guilds x channels x websites (per channel), `users` per guild each subscribed to `subscriptions` websites.
+    # Websites point at `urls` distinct urls spread over `hosts` hosts, so guilds share pages like in production.
+    from domain.classes import ETagMonitor
+
+    rng = random.Random(seed)
+    monitor = monitor or ETagMonitor
+    base = Base()
+    page = 0
+    for guild_id in range(1, guilds + 1):
+        server = Server(guild_id)
+        guild_websites: list[Website] = []
+        for channel_index in range(channels):
+            channel = Channel(guild_id * 1000 + channel_index, server)
+            for website_index in range(websites):
+                url = url_format.format(host=page % hosts, page=page % urls)
+                page += 1
+                guild_websites.append(
+                    Website(f"site-{channel_index}-{website_index}", url, channel, monitor)
+                )
+        for user_index in range(users):
+            user = User(guild_id * 100000 + user_index)
+            for website in rng.sample(guild_websites, min(subscriptions, len(guild_websites))):
+                user.add_website(website)
+        base.add_server(server)
+    CHANGES.clear()
+    return base
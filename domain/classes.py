@@ -1,40 +1,183 @@
 from __future__ import annotations
 
-import difflib
-import os
+import asyncio
+import csv
+import hashlib
+import hmac
+import io
+import secrets
+import sys
+import time
 from abc import ABC, abstractmethod
+from collections.abc import Collection, Iterator
 from datetime import datetime
 from pathlib import Path
-from requests import get
+from typing import TYPE_CHECKING
+from domain.pipeline import process_update
+from engine.metrics import METRICS
+from network.caching import freshness_lifetime, retry_after
+from network.feeds import PageIndex
+from network.fetcher import BadStatus
+from network.websub import find_links, parse_links
+from persistence.blobs import BlobStore
+
+if TYPE_CHECKING:
+    from network.fetcher import AsyncFetcher, Response
+    from engine.processing import UpdateProcessor
+
+
+class Changes:
+    # Tables (and the keys of their rows) modified since the last save
+    def __init__(self) -> None:
+        self._dirty: dict[str, set[object]] = {}
+
+    def mark(self, table: str, key: object = None):
+        self._dirty.setdefault(table, set()).add(key)
+
+    def is_dirty(self) -> bool:
+        return bool(self._dirty)
+
+    def pop(self) -> dict[str, set[object]]:
+        res = self._dirty
+        self._dirty = {}
+        return res
+
+    def merge(self, dirty: dict[str, set[object]]):
+        for table, keys in dirty.items():
+            self._dirty.setdefault(table, set()).update(keys)
+
+    def clear(self):
+        self._dirty = {}
+
+
+CHANGES = Changes()
 
 
 class Base:
+    __slots__ = ("_servers", "_channels", "_websites", "_urls", "_users", "_subscription_count")
+
     def __init__(self, servers: list[Server] = []) -> None:
         self._servers: dict[int, Server] = {}
+        # Kept up to date by the servers, so that lookups never walk the whole tree
+        self._channels: dict[int, Channel] = {}
+        self._websites: dict[tuple[int, str], Website] = {}
+        self._urls: dict[str, dict[tuple[int, str], Website]] = {}
+        # user id -> server id -> User, the subscriptions themselves are only stored by the users
+        self._users: dict[int, dict[int, User]] = {}
+        self._subscription_count = 0
         for server in servers:
             self.add_server(server)
 
     def add_server(self, server: Server):
         self._servers[server.get_id()] = server
-
-    def get_servers(self) -> list[Server]:
-        return list(self._servers.values())
+        CHANGES.mark("servers", server.get_id())
+        server.set_base(self)
+        for channel in server.get_channels():
+            self.index_channel(channel)
+        for website in server.get_websites():
+            self.index_website(website)
+            for user in website.get_users():
+                self.index_subscription(user, website)
+
+    def get_servers(self) -> Collection[Server]:
+        return self._servers.values()
 
     def get_server(self, id: int) -> Server | None:
         return self._servers.get(id)
 
+    def index_channel(self, channel: Channel):
+        self._channels[channel.get_id()] = channel
+
+    def index_website(self, website: Website):
+        self._websites[website.get_key()] = website
+        self._urls.setdefault(website.get_url(), {})[website.get_key()] = website
+
+    def unindex_website(self, website: Website):
+        self._websites.pop(website.get_key(), None)
+        websites = self._urls.get(website.get_url(), {})
+        websites.pop(website.get_key(), None)
+        if not websites:
+            self._urls.pop(website.get_url(), None)
+
+    def index_subscription(self, user: User, website: Website):
+        self._users.setdefault(user.get_id(), {})[website.get_key()[0]] = user
+        self._subscription_count += 1
+
+    def unindex_subscription(self, user: User, website: Website):
+        self._subscription_count -= 1
+        if not user.get_websites():
+            users = self._users.get(user.get_id(), {})
+            users.pop(website.get_key()[0], None)
+            if not users:
+                self._users.pop(user.get_id(), None)
+
+    def get_channel(self, id: int) -> Channel | None:
+        return self._channels.get(id)
+
+    def get_website(self, server_id: int, name: str) -> Website | None:
+        return self._websites.get((server_id, name))
+
+    def get_websites_by_url(self, url: str) -> Collection[Website]:
+        return self._urls.get(url, {}).values()
+
+    def get_subscriptions(self, user_id: int) -> Iterator[Website]:
+        for user in self._users.get(user_id, {}).values():
+            yield from user.get_websites()
+
+    def has_subscriptions(self, user_id: int) -> bool:
+        return user_id in self._users
+
+    def is_subscribed(self, user_id: int, server_id: int, name: str) -> bool:
+        user = self._users.get(user_id, {}).get(server_id)
+        return user is not None and user.get_website(name) is not None
+
+    def get_website_count(self) -> int:
+        return len(self._websites)
+
+    def get_subscription_count(self) -> int:
+        return self._subscription_count
+
 
 class Server:
+    __slots__ = ("_id", "_channels", "_users", "_websites", "_base")
+
     def __init__(self, id: int, default_channel: Channel | None = None) -> None:
         self._id = id
         self._channels: dict[int, Channel] = {}
         self._users: dict[int, User] = {}
+        self._websites: dict[str, Website] = {}
+        self._base: Base | None = None
+
+    def set_base(self, base: Base):
+        self._base = base
 
     def add_channel(self, channel: Channel):
         self._channels[channel.get_id()] = channel
+        CHANGES.mark("channels", channel.get_id())
+        if self._base is not None:
+            self._base.index_channel(channel)
+
+    def index_website(self, website: Website):
+        self._websites[website.get_name()] = website
+        if self._base is not None:
+            self._base.index_website(website)
+
+    def unindex_website(self, website: Website):
+        self._websites.pop(website.get_name(), None)
+        if self._base is not None:
+            self._base.unindex_website(website)
+
+    def index_subscription(self, user: User, website: Website):
+        if self._base is not None:
+            self._base.index_subscription(user, website)
+
+    def unindex_subscription(self, user: User, website: Website):
+        if self._base is not None:
+            self._base.unindex_subscription(user, website)
 
     def add_user(self, user: User):
         self._users[user.get_id()] = user
+        CHANGES.mark("users", user.get_id())
 
     def get_user(self, id: int) -> User | None:
         return self._users.get(id)
@@ -42,33 +185,28 @@ class Server:
     def get_channel(self, id: int) -> Channel:
         return self._channels.get(id)
 
-    def get_channels(self) -> list[Channel]:
-        return list(self._channels.values())
+    def get_channels(self) -> Collection[Channel]:
+        return self._channels.values()
 
     def get_id(self) -> int:
         return self._id
 
-    def get_websites(self) -> list[Website]:
-        res: list[Website] = []
-        for channel in self.get_channels():
-            res.extend(channel.get_websites())
-
-        return res
+    def get_websites(self) -> Collection[Website]:
+        return self._websites.values()
 
     def get_website(self, name: str) -> Website | None:
-        for channel in self.get_channels():
-            res = channel.get_website(name)
-            if res is not None:
-                return res
+        return self._websites.get(name)
 
     def remove_website(self, name: str) -> Website | None:
-        for channel in self.get_channels():
-            res = channel.remove_website(name)
-            if res is not None:
-                return res
+        website = self._websites.get(name)
+        if website is None:
+            return None
+        return website.get_channel().remove_website(name)
 
 
 class Channel:
+    __slots__ = ("_websites", "_id", "_server")
+
     def __init__(self, id: int, server: Server) -> None:
         self._websites: dict[str, Website] = {}
         self._id = id
@@ -77,12 +215,14 @@ class Channel:
 
     def add_website(self, website: Website):
         self._websites[website.get_name()] = website
+        CHANGES.mark("websites", website.get_key())
+        self._server.index_website(website)
 
     def get_id(self) -> int:
         return self._id
 
-    def get_websites(self) -> list[Website]:
-        return list(self._websites.values())
+    def get_websites(self) -> Collection[Website]:
+        return self._websites.values()
 
     def get_website(self, name: str) -> Website | None:
         return self._websites.get(name)
@@ -94,6 +234,8 @@ class Channel:
         if name not in self._websites:
             return None
         website = self._websites.pop(name)
+        CHANGES.mark("websites", website.get_key())
+        self._server.unindex_website(website)
         website.removal()
         return website
 
@@ -102,19 +244,26 @@ class Channel:
 
 
 class Website:
+    __slots__ = ("_name", "_url", "_normalizer", "_key", "_channel", "_users", "_monitor")
+
     def __init__(
             self,
             name: str,
             url: str,
             channel: Channel,
             monitor: type[Monitor],
+            normalizer: str = "",
     ) -> None:
-        self._name = name
-        self._url = url
+        # Interned: the same urls and names are repeated across guilds, monitors and indexes
+        self._name = sys.intern(name)
+        self._url = sys.intern(url)
+        # Spec of domain.normalize applied to the page before it is compared, empty to compare it as is
+        self._normalizer = sys.intern(normalizer)
+        self._key = (channel.get_server().get_id(), self._name)
         self._channel = channel
         channel.add_website(self)
         self._users: dict[int, User] = {}
-        self._monitor: Monitor = monitor(self)
+        self._monitor: Monitor = monitor.for_website(self)
 
     def get_name(self) -> str:
         return self._name
@@ -122,6 +271,12 @@ class Website:
     def get_url(self) -> str:
         return self._url
 
+    def get_normalizer(self) -> str:
+        return self._normalizer
+
+    def get_key(self) -> tuple[int, str]:
+        return self._key
+
     def get_monitor(self) -> Monitor:
         return self._monitor
 
@@ -129,21 +284,30 @@ class Website:
         return self._channel
 
     def add_user(self, user: User):
-        self._users[user.get_id()] = user
+        if user.get_id() not in self._users:
+            self._users[user.get_id()] = user
+            self._channel.get_server().index_subscription(user, self)
 
-    def get_users(self) -> list[User]:
-        return list(self._users.values())
+    def remove_user(self, user: User):
+        if self._users.pop(user.get_id(), None) is not None:
+            self._channel.get_server().unindex_subscription(user, self)
+
+    def get_users(self) -> Collection[User]:
+        return self._users.values()
 
     def get_hyperlink(self) -> str:
         return f"[{self.get_name()}]({self.get_url()})"
 
     def removal(self):
-        self._monitor.unmonitor()
-        for user in self.get_users():
+        self._monitor.remove_website(self)
+        # Copied, every removal also drops the user from self._users
+        for user in list(self._users.values()):
             user.remove_website(self._name)
 
 
 class User:
+    __slots__ = ("__id", "_websites")
+
     def __init__(self, id: int, website: Website | None = None) -> None:
         self.__id = id
         self._websites: dict[str, Website] = {}
@@ -160,30 +324,152 @@ class User:
         self._websites[website.get_name()] = website
         website.add_user(self)
         self.register(website)
+        CHANGES.mark("users_websites", (self.get_id(), *website.get_key()))
 
     def remove_website(self, name: str) -> Website | None:
         if name not in self._websites:
             return None
-        return self._websites.pop(name)
+        website = self._websites.pop(name)
+        website.remove_user(self)
+        CHANGES.mark("users", self.get_id())
+        CHANGES.mark("users_websites", (self.get_id(), *website.get_key()))
+        return website
+
+    def get_website(self, name: str) -> Website | None:
+        return self._websites.get(name)
 
-    def get_websites(self) -> list[Website]:
-        return list(self._websites.values())
+    def get_websites(self) -> Collection[Website]:
+        return self._websites.values()
 
     def get_hyperlink(self) -> str:
         return f"<@{self.get_id()}>"
 
 
 class Monitor(ABC):
+    __slots__ = ("_url", "_spec", "_key", "_websites", "_interval", "_not_before", "_failures")
+
+    # One monitor per (monitor class, key), shared by every Website watching that url with the same normalizer
+    _monitors: dict[tuple[type[Monitor], str], Monitor] = {}
+
+    @staticmethod
+    def make_key(url: str, spec: str = "") -> str:
+        # Urls can't contain spaces, a monitor without a spec keeps its url as key
+        return f"{url} {spec}" if spec else url
+
+    @classmethod
+    def for_website(cls, website: Website) -> Monitor:
+        key = (cls, Monitor.make_key(website.get_url(), website.get_normalizer()))
+        monitor = Monitor._monitors.get(key)
+        if monitor is None:
+            monitor = cls(website.get_url(), website.get_normalizer())
+            Monitor._monitors[key] = monitor
+            monitor.mark_dirty()
+        monitor.add_website(website)
+        return monitor
+
+    @staticmethod
+    def get_monitors() -> Collection[Monitor]:
+        return Monitor._monitors.values()
+
+    @staticmethod
+    def find(monitor_class: type[Monitor], key: str) -> Monitor | None:
+        return Monitor._monitors.get((monitor_class, key))
+
     @abstractmethod
-    def __init__(self, website: Website) -> None:
-        self._website = website
+    def __init__(self, url: str, spec: str = "") -> None:
+        self._url = sys.intern(url)
+        self._spec = sys.intern(spec)
+        self._key = sys.intern(Monitor.make_key(url, spec))
+        self._websites: dict[tuple[int, str], Website] = {}
+        self._interval: float = 300
+        # Wall clock time before which the website should not be checked, from the caching headers
+        self._not_before: float = 0
+        # Checks that failed in a row
+        self._failures: int = 0
+
+    def get_url(self) -> str:
+        return self._url
+
+    def get_spec(self) -> str:
+        return self._spec
+
+    def get_key(self) -> str:
+        return self._key
+
+    def get_table(self) -> str:
+        return f"monitors/{self.__class__.__name__}"
+
+    def mark_dirty(self):
+        CHANGES.mark(self.get_table(), self._key)
+
+    def get_interval(self) -> float:
+        return self._interval
+
+    def set_interval(self, interval: float):
+        if interval != self._interval:
+            self._interval = interval
+            self.mark_dirty()
+
+    def get_not_before(self) -> float:
+        return self._not_before
+
+    def set_not_before(self, not_before: float):
+        if not_before != self._not_before:
+            self._not_before = not_before
+            self.mark_dirty()
+
+    def get_failures(self) -> int:
+        return self._failures
+
+    def add_failure(self) -> int:
+        self._failures += 1
+        self.mark_dirty()
+        return self._failures
+
+    def reset_failures(self):
+        if self._failures:
+            self._failures = 0
+            self.mark_dirty()
+
+    def get_websites(self) -> Collection[Website]:
+        return self._websites.values()
+
+    def get_server_ids(self) -> set[int]:
+        return {website.get_key()[0] for website in self._websites.values()}
+
+    def is_push_active(self) -> bool:
+        # Monitors told about changes by the website itself only need an occasional poll
+        return False
+
+    def add_website(self, website: Website):
+        self._websites[website.get_key()] = website
+
+    def remove_website(self, website: Website):
+        self._websites.pop(website.get_key(), None)
+        if not self._websites:
+            Monitor._monitors.pop((self.__class__, self._key), None)
+            self.mark_dirty()
+            self.unmonitor()
+
+    @abstractmethod
+    def has_baseline(self) -> bool:
+        pass
 
     @abstractmethod
     def is_updated(self) -> None | str:
         pass
 
     @abstractmethod
-    def check_update(self):
+    async def check_update(self, fetcher: AsyncFetcher, processor: UpdateProcessor) -> bool:
+        # False when the server did not answer for the page and asked to come back later
+        pass
+
+    @abstractmethod
+    def save_content(self, content: str, delta: list[list] | None = None, base: str | None = None):
+        pass
+
+    @abstractmethod
+    def take_content(self) -> tuple[str, list[list] | None, str | None] | None:
         pass
 
     @abstractmethod
@@ -200,95 +486,434 @@ class Monitor(ABC):
 
 
 class ETagMonitor(Monitor):
-    data_dir = Path("./data/ETagMonitor")
+    __slots__ = (
+        "_etag",
+        "_last_modified",
+        "_last_update",
+        "_updated",
+        "_diff",
+        "_digest",
+        "_body_digest",
+        "_content",
+        "_size",
+    )
 
-    def __init__(self, website: Website) -> None:
-        super().__init__(website)
+    data_dir = Path("./data/ETagMonitor")
+    store = BlobStore(data_dir)
+    # Characters of diff worth computing, a Discord message can't show more
+    diff_budget = 2000
+    # Off in shard workers, which hand the new page to the bot with take_content
+    save_pages = True
+    # Pages at least this big are probed with a HEAD request first, 0 never probes
+    head_probe_size = 0
+
+    def __init__(self, url: str, spec: str = "") -> None:
+        super().__init__(url, spec)
+        # Validators exactly as the server sent them
         self._etag: None | str = None
+        self._last_modified: None | str = None
         self._last_update: None | datetime = None
         self._updated: bool = False
         self._diff: None | str = None
-        self._content: str = ""
-        self._target: Path = self.data_dir.joinpath(self._website.get_name() + ".html")
-        self.load_content()
-
-    def load_content(self):
-        if Path(self.data_dir).exists() and self._target.exists():
-            self._content = self._target.read_text(encoding="utf-8")
-        else:
-            try:
-                self._content = get(self._website.get_url(),timeout=10).text
-                self.save_content()
-            except Exception:
-                self._content = ""
-
-    def save_content(self):
-        if not Path(self.data_dir).exists():
-            os.mkdir(self.data_dir)
-        self._target.write_text(self._content)
+        # Only the digest of the last page is kept in memory, the page itself stays in the store
+        self._digest: None | str = None
+        # Digest of the raw body, not persisted: after a restart the first body is decoded once more
+        self._body_digest: None | bytes = None
+        # New page, its history delta and the digest of the page the delta rebuilds, for the bot to store
+        self._content: None | tuple[str, list[list] | None, str | None] = None
+        self._size: int = 0
 
-    def check_update(self):
-        headers = {
-            "If-None-Match": self._etag,
-            "If-Modified-Since": self._last_update.strftime("%a, %d %b %Y %H:%M:%S GMT") if self._last_update else None,
-        }
-
-        print(f"[{datetime.now()}] Sending request to {self._website.get_url()} with headers: {headers}")
-
-        res = get(self._website.get_url(), headers=headers, timeout=10)
+    def add_website(self, website: Website):
+        first = not self._websites
+        super().add_website(website)
+        # Legacy pages were stored as fetched, they are no baseline for a normalized page
+        if first and not self._spec:
+            self.adopt_legacy_page(website)
+
+    def adopt_legacy_page(self, website: Website):
+        # Pages used to be plain files named after the url hash, or before that after the subscription name
+        legacy_pages = [
+            self.data_dir.joinpath(hashlib.sha256(self._url.encode()).hexdigest()[:32] + ".html"),
+            self.data_dir.joinpath(website.get_name() + ".html"),
+        ]
+        for legacy in legacy_pages:
+            if legacy.exists():
+                if not self.store.has(self._key):
+                    self.store.record(self._key, legacy.read_text(encoding="utf-8"))
+                legacy.unlink()
+
+    def load_content(self) -> str:
+        return self.store.latest(self._key) or ""
+
+    def has_baseline(self) -> bool:
+        # Without a stored page the next check_update records the baseline, a digest alone can't be diffed against
+        return self.store.has(self._key)
+
+    def save_content(self, content: str, delta: list[list] | None = None, base: str | None = None):
+        self.store.record(self._key, content, delta, base)
+
+    def take_content(self) -> tuple[str, list[list] | None, str | None] | None:
+        content = self._content
+        self._content = None
+        return content
+
+    def get_conditional_headers(self) -> dict[str, str]:
+        headers: dict[str, str] = {}
+        if self._etag is not None:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified is not None:
+            headers["If-Modified-Since"] = self._last_modified
+        return headers
+
+    def has_same_validators(self, res: Response) -> bool:
+        etag = res.headers.get("ETag")
+        if etag is not None and self._etag is not None:
+            return etag == self._etag
+        last_modified = res.headers.get("Last-Modified")
+        return last_modified is not None and last_modified == self._last_modified
+
+    def update_validators(self, res: Response):
+        etag = res.headers.get("ETag")
+        last_modified = res.headers.get("Last-Modified")
+        if etag != self._etag or last_modified != self._last_modified:
+            self._etag = etag
+            self._last_modified = last_modified
+            self.mark_dirty()
+
+    def update_freshness(self, res: Response):
+        # Fresh responses and servers asking to slow down push the next check back
+        now = time.time()
+        if res.status in (429, 503):
+            delay = retry_after(res.headers, now)
+            if delay is not None:
+                self.set_not_before(now + delay)
+        elif res.ok:
+            lifetime = freshness_lifetime(res.headers)
+            self.set_not_before(now + lifetime if lifetime else 0)
+
+    def inspect(self, res: Response):
+        # Every response of check_update goes through here, before the page is compared
+        self.update_freshness(res)
+
+    async def check_update(self, fetcher: AsyncFetcher, processor: UpdateProcessor) -> bool:
+        # Without a baseline the page is fetched whole, a 304 would never give one
+        baseline = self.has_baseline()
+        headers = self.get_conditional_headers() if baseline else {}
+
+        if self.head_probe_size and self._size >= self.head_probe_size and headers:
+            # A large page is only downloaded when the validators of a HEAD response say it changed
+            probe = await fetcher.head(self._url, headers=headers)
+            if probe.status == 304 or (probe.ok and self.has_same_validators(probe)):
+                self.inspect(probe)
+                return True
+
+        print(f"[{datetime.now()}] Sending request to {self._url} with headers: {headers}")
+
+        res = await fetcher.get(self._url, headers=headers)
+        self.inspect(res)
 
         if not res.ok:
-            return
-
-        if self._etag is None:
-            if "ETag" in res.headers:
-                self._etag = res.headers["ETag"]
-
-        if self._last_update is None:
-            self._last_update = datetime.utcnow()
-
-        if res.status_code != 304:
+            if res.status in (429, 503):
+                # Not a failure of the page, Retry-After already pushed the next check back
+                return False
+            # Counted as a failure, so an origin that keeps erroring is backed off like an unreachable one
+            raise BadStatus(self._url, res.status)
+
+        if res.status == 304:
+            # A 304 may carry newer validators for the same content
+            if "ETag" in res.headers or "Last-Modified" in res.headers:
+                self.update_validators(res)
+            return True
+
+        self._size = len(res.body)
+        if baseline and res.digest == self._body_digest:
+            # Same bytes as last time, a server that ignores the conditional headers: nothing to decode
+            self.update_validators(res)
+            return True
+
+        # Decoding, hashing, diffing and the delta of the page history run in the process pool for large pages
+        base = self.store.latest_digest(self._key)
+        with METRICS.timer("diff_seconds"):
+            text, new_digest, diff, delta = await processor.run(
+                len(res.body),
+                process_update,
+                res.body,
+                res.charset,
+                str(self.store.blob_path(base)) if base else None,
+                self._digest if baseline else None,
+                self.diff_budget,
+                self._spec,
+            )
+        if text is None:
+            # Same page as before, in different bytes or after a restart
+            self._digest = new_digest
+            self._body_digest = res.digest
+            self.update_validators(res)
+            return True
+
+        if baseline or new_digest != self._digest:
             print("Update detected")
             self._updated = True
-            if "ETag" in res.headers:
-                self._etag = res.headers["ETag"]
             self._last_update = datetime.utcnow()
-            if self._content != "":
-                self._diff = "\n".join(
-                    difflib.unified_diff(self._content.splitlines(), res.text.splitlines(), fromfile="Before",
-                                         tofile="After"))
-            else:
-                self._diff = None
-            self._content = res.text
-            self.save_content()
+            self._diff = diff
+        self._digest = new_digest
+        if self.save_pages:
+            await asyncio.to_thread(self.save_content, text, delta, base)
+        else:
+            self._content = (text, delta, base)
+        # Only taken once the page is stored, or a failure would turn the next check into a 304 that misses it
+        self._body_digest = res.digest
+        self.update_validators(res)
+        self.mark_dirty()
+        return True
 
     def is_updated(self) -> None | str:
         res = self._updated
         self._updated = False
+        diff = self._diff
+        # Only kept until it is handed over, the stored pages can give it again
+        self._diff = None
         if res:
-            return self._diff
+            self.mark_dirty()
+            return diff
         else:
             return None
 
+    def get_row(self) -> list[object]:
+        return [
+            self._key,
+            self._etag,
+            self._updated,
+            self._last_update.isoformat() if self._last_update else None,
+            self._interval,
+            self._digest,
+            self._last_modified,
+            self._not_before,
+            self._failures,
+        ]
+
     def get_data(self) -> str:
-        return f"{self._website.get_url()},{self._etag},{self._updated},{self._last_update.isoformat()}"
+        # Quoted like any CSV row, validators can contain quotes and dates contain commas
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="").writerow(["None" if value is None else value for value in self.get_row()])
+        return buffer.getvalue()
 
     def set_data(self, data: list[str]):
         etag = data[1]
         if etag != "None":
-            self._etag = f'"{etag}"'
+            # Rows written before the quoting lost the quotes of strong ETags
+            self._etag = etag if etag.startswith(('"', "W/")) else f'"{etag}"'
         updated = data[2]
         self._updated = updated == "True"
         try:
             last_update = data[3]
-            self._last_update = datetime.fromisoformat(last_update)
+            if last_update != "None":
+                self._last_update = datetime.fromisoformat(last_update)
         except IndexError as e:
             return
         try:
-            content = data[4]
-            self._content = content
+            interval = data[4]
+            self._interval = float(interval)
+        except (IndexError, ValueError) as e:
+            return
+        try:
+            digest = data[5]
+            if digest != "None":
+                self._digest = digest
         except IndexError as e:
             return
+        try:
+            last_modified = data[6]
+            if last_modified != "None":
+                self._last_modified = last_modified
+            self._not_before = float(data[7])
+            self._failures = int(data[8])
+        except (IndexError, ValueError) as e:
+            return
+
+    def unmonitor(self):
+        self.store.forget(self._key)
+
+
+class PushMonitor(ETagMonitor):
+    __slots__ = ("_hub", "_topic", "_secret", "_callback_id", "_lease_until", "_requested", "_pushed")
+
+    data_dir = Path("./data/PushMonitor")
+    store = BlobStore(data_dir)
+    # Monitors by the id in the url of their callback
+    _callbacks: dict[str, PushMonitor] = {}
+    # Only the start of a page is searched for a hub, that is where <link> elements are
+    discovery_size = 64 * 1024
+    # Seconds a subscription request waits for the hub to verify it
+    verify_window = 60 * 60
+
+    def __init__(self, url: str, spec: str = "") -> None:
+        super().__init__(url, spec)
+        # Announced by the website, the topic is the url the hub knows the page by
+        self._hub: None | str = None
+        self._topic: None | str = None
+        self._secret = ""
+        self._callback_id = ""
+        # Wall clock time the subscription to the hub runs out, 0 when there is none
+        self._lease_until: float = 0
+        # Not persisted: subscriptions that are pending after a restart are requested again
+        self._requested: float = 0
+        self._pushed: bool = False
+        self.set_secret(secrets.token_hex(16))
+
+    @staticmethod
+    def find_callback(callback_id: str) -> PushMonitor | None:
+        return PushMonitor._callbacks.get(callback_id)
+
+    @staticmethod
+    def get_push_monitors() -> Collection[PushMonitor]:
+        return PushMonitor._callbacks.values()
+
+    def get_hub(self) -> None | str:
+        return self._hub
+
+    def get_topic(self) -> str:
+        return self._topic or self._url
+
+    def get_secret(self) -> str:
+        return self._secret
+
+    def set_secret(self, secret: str):
+        # The callback id is derived from the secret, so it can't be guessed from the url
+        PushMonitor._callbacks.pop(self._callback_id, None)
+        self._secret = secret
+        self._callback_id = hmac.new(secret.encode(), self._key.encode(), "sha256").hexdigest()[:24]
+        PushMonitor._callbacks[self._callback_id] = self
+
+    def get_callback_id(self) -> str:
+        return self._callback_id
+
+    def get_lease_until(self) -> float:
+        return self._lease_until
+
+    def set_lease_until(self, lease_until: float):
+        if lease_until != self._lease_until:
+            self._lease_until = lease_until
+            self.mark_dirty()
+
+    def is_push_active(self) -> bool:
+        return self._lease_until > time.time()
+
+    def get_requested(self) -> float:
+        return self._requested
+
+    def set_requested(self, requested: float):
+        self._requested = requested
+
+    def is_verifiable(self) -> bool:
+        return time.time() - self._requested < self.verify_window
+
+    def push_received(self):
+        self._pushed = True
+
+    def inspect(self, res: Response):
+        super().inspect(res)
+        if not res.ok:
+            return
+        links = parse_links(res.headers.getall("Link", []), self._url)
+        if "hub" not in links and res.status == 200:
+            links = find_links(res.body[:self.discovery_size], self._url)
+        hub = links.get("hub")
+        if hub is not None and (hub, links.get("self")) != (self._hub, self._topic):
+            # Subscriptions to the previous hub or topic are left to expire
+            self._hub = hub
+            self._topic = links.get("self")
+            self._lease_until = 0
+            self.mark_dirty()
+
+    async def check_update(self, fetcher: AsyncFetcher, processor: UpdateProcessor) -> bool:
+        pushed = self._pushed
+        self._pushed = False
+        last_update = self._last_update
+        answered = await super().check_update(fetcher, processor)
+        # A push that arrived during the check may be about this very change
+        if self._last_update != last_update and not pushed and not self._pushed and self.is_push_active():
+            # The hub missed a change, the page is polled as usual until the subscription is renewed
+            print(f"{self._hub} did not push the last change of {self._url}")
+            self.set_lease_until(0)
+        return answered
+
+    def get_row(self) -> list[object]:
+        return [*super().get_row(), self._hub, self._topic, self._secret, self._lease_until]
+
+    def set_data(self, data: list[str]):
+        super().set_data(data)
+        try:
+            hub, topic, secret, lease_until = data[9:13]
+        except ValueError as e:
+            return
+        self._hub = hub if hub != "None" else None
+        self._topic = topic if topic != "None" else None
+        if secret != self._secret:
+            self.set_secret(secret)
+        self._lease_until = float(lease_until)
+
+    def unmonitor(self):
+        super().unmonitor()
+        PushMonitor._callbacks.pop(self._callback_id, None)
+
+
+class IndexedMonitor(ETagMonitor):
+    __slots__ = ("_index", "_listed")
+
+    data_dir = Path("./data/IndexedMonitor")
+    store = BlobStore(data_dir)
+    # Seconds a sitemap or feed is reused by the other pages it lists
+    index_max_age: float = 60
+
+    def __init__(self, url: str, spec: str = "") -> None:
+        super().__init__(url, spec)
+        # Url of the sitemap or feed listing the page
+        self._index: None | str = None
+        # Date of the last change of the page in the index, when it was last checked
+        self._listed: None | str = None
+
+    def get_index(self) -> None | str:
+        return self._index
+
+    def set_index(self, index: None | str):
+        if index == self._index:
+            return
+        if self._index is not None:
+            PageIndex.get(self._index).unwatch(self._url)
+        self._index = index
+        self._listed = None
+        if index is not None:
+            PageIndex.get(index).watch(self._url)
+        self.mark_dirty()
+
+    async def check_update(self, fetcher: AsyncFetcher, processor: UpdateProcessor) -> bool:
+        listed = None
+        if self._index is not None:
+            listed = await PageIndex.get(self._index).lookup(self._url, fetcher, self.index_max_age)
+            if listed is not None and listed == self._listed and self.has_baseline():
+                # The index says the page did not change since it was last fetched
+                return True
+        # Failed checks raise, and a page the server did not answer for is fetched again next time
+        answered = await super().check_update(fetcher, processor)
+        if answered and listed != self._listed:
+            self._listed = listed
+            self.mark_dirty()
+        return answered
+
+    def get_row(self) -> list[object]:
+        return [*super().get_row(), self._index, self._listed]
+
+    def set_data(self, data: list[str]):
+        super().set_data(data)
+        try:
+            index, listed = data[9:11]
+        except ValueError as e:
+            return
+        self.set_index(index if index != "None" else None)
+        self._listed = listed if listed != "None" else None
 
     def unmonitor(self):
-        os.remove(self._target)
+        super().unmonitor()
+        if self._index is not None:
+            PageIndex.get(self._index).unwatch(self._url)
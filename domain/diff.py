@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+
+
+def intern_lines(before: list[str], after: list[str]) -> tuple[list[int], list[int]]:
+    # Compare small integers instead of whole lines
+    ids: dict[str, int] = {}
+    a = [ids.setdefault(line, len(ids)) for line in before]
+    b = [ids.setdefault(line, len(ids)) for line in after]
+    return a, b
+
+
+def myers(
+        a: list[int], alo: int, ahi: int, b: list[int], blo: int, bhi: int, max_edits: int, max_work: int,
+) -> tuple[list[tuple[int, int]] | None, int]:
+    # Greedy O(ND) shortest edit script and the diagonals it walked, gives up (None) past max_edits or max_work
+    n = ahi - alo
+    m = bhi - blo
+    offset = n + m + 1
+    v = [0] * (2 * offset + 1)
+    trace: list[list[int]] = []
+    work = 0
+    for d in range(min(n + m, max_edits) + 1):
+        work += d + 1
+        if work > max_work:
+            break
+        # Only diagonals -d-1..d+1 can be read while backtracking from this round
+        trace.append(v[offset - d - 1:offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return backtrack(trace, alo, blo, n, m, d), work
+    return None, work
+
+
+def backtrack(trace: list[list[int]], alo: int, blo: int, n: int, m: int, d: int) -> list[tuple[int, int]]:
+    matches: list[tuple[int, int]] = []
+    x, y = n, m
+    for d in range(d, 0, -1):
+        v = trace[d]
+        base = d + 1
+        k = x - y
+        if k == -d or (k != d and v[base + k - 1] < v[base + k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[base + prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            matches.append((alo + x, blo + y))
+        x, y = prev_x, prev_y
+    while x > 0 and y > 0:
+        x -= 1
+        y -= 1
+        matches.append((alo + x, blo + y))
+    matches.reverse()
+    return matches
+
+
+def unique_anchors(a: list[int], alo: int, ahi: int, b: list[int], blo: int, bhi: int) -> list[tuple[int, int]]:
+    # Patience diff: lines occurring exactly once on both sides, kept in their longest increasing order
+    counts: dict[int, list[int]] = {}
+    for i in range(alo, ahi):
+        entry = counts.get(a[i])
+        if entry is None:
+            counts[a[i]] = [1, 0, i, 0]
+        else:
+            entry[0] += 1
+    for j in range(blo, bhi):
+        entry = counts.get(b[j])
+        if entry is not None:
+            entry[1] += 1
+            entry[3] = j
+
+    pairs = sorted((entry[2], entry[3]) for entry in counts.values() if entry[0] == 1 and entry[1] == 1)
+    if not pairs:
+        return []
+
+    tails: list[int] = []
+    tails_index: list[int] = []
+    previous: list[int] = [-1] * len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        position = bisect_left(tails, j)
+        if position > 0:
+            previous[index] = tails_index[position - 1]
+        if position == len(tails):
+            tails.append(j)
+            tails_index.append(index)
+        else:
+            tails[position] = j
+            tails_index[position] = index
+
+    res: list[tuple[int, int]] = []
+    index = tails_index[-1]
+    while index != -1:
+        res.append(pairs[index])
+        index = previous[index]
+    res.reverse()
+    return res
+
+
+def match_lines(a: list[int], b: list[int], max_edits: int, max_work: int) -> list[tuple[int, int]]:
+    # max_edits bounds every gap, max_work all of them: a reshuffled page has many gaps left to Myers
+    matches: list[tuple[int, int]] = []
+    stack: list[tuple[int, int, int, int] | tuple[int, int]] = [(0, len(a), 0, len(b))]
+    while stack:
+        item = stack.pop()
+        if len(item) == 2:
+            matches.append(item)
+            continue
+        alo, ahi, blo, bhi = item
+
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+        suffix = 0
+        while alo < ahi - suffix and blo < bhi - suffix and a[ahi - suffix - 1] == b[bhi - suffix - 1]:
+            suffix += 1
+        # Pushed first so they are emitted after everything in the middle
+        for i in range(suffix - 1, -1, -1):
+            stack.append((ahi - suffix + i, bhi - suffix + i))
+        ahi -= suffix
+        bhi -= suffix
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchors = unique_anchors(a, alo, ahi, b, blo, bhi)
+        if anchors:
+            pending: list[tuple[int, int, int, int] | tuple[int, int]] = []
+            for i, j in anchors:
+                pending.append((alo, i, blo, j))
+                pending.append((i, j))
+                alo, blo = i + 1, j + 1
+            pending.append((alo, ahi, blo, bhi))
+            stack.extend(reversed(pending))
+        elif max_work > 0 and not set(a[alo:ahi]).isdisjoint(b[blo:bhi]):
+            # Everything left repeats, fall back to Myers, or to a plain replacement if the gap is too different
+            gap, work = myers(a, alo, ahi, b, blo, bhi, max_edits, max_work)
+            matches.extend(gap or [])
+            max_work -= work
+    return matches
+
+
+def opcodes(matches: list[tuple[int, int]], n: int, m: int) -> list[tuple[str, int, int, int, int]]:
+    res: list[tuple[str, int, int, int, int]] = []
+    i = j = 0
+    for mi, mj in [*matches, (n, m)]:
+        if i < mi or j < mj:
+            res.append(("replace" if i < mi and j < mj else "delete" if i < mi else "insert", i, mi, j, mj))
+        if mi < n and mj < m:
+            if res and res[-1][0] == "equal":
+                tag, i1, _, j1, _ = res.pop()
+                res.append(("equal", i1, mi + 1, j1, mj + 1))
+            else:
+                res.append(("equal", mi, mi + 1, mj, mj + 1))
+        i, j = mi + 1, mj + 1
+    return res
+
+
+def format_range(start: int, stop: int) -> str:
+    length = stop - start
+    if length == 1:
+        return f"{start + 1}"
+    if length == 0:
+        return f"{start},0"
+    return f"{start + 1},{length}"
+
+
+def diff_opcodes(
+        before: list[str], after: list[str], max_edits: int = 256, max_work: int = 1_000_000,
+) -> list[tuple[str, int, int, int, int]]:
+    # Trim the common prefix and suffix on the raw lines, most page updates only touch a small region
+    limit = min(len(before), len(after))
+    prefix = next((i for i, (x, y) in enumerate(zip(before, after)) if x != y), limit)
+    suffix = next(
+        (i for i, (x, y) in enumerate(zip(reversed(before), reversed(after))) if x != y or i >= limit - prefix),
+        limit - prefix,
+    )
+
+    a, b = intern_lines(before[prefix:len(before) - suffix], after[prefix:len(after) - suffix])
+    codes = [
+        (tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix)
+        for tag, i1, i2, j1, j2 in opcodes(match_lines(a, b, max_edits, max_work), len(a), len(b))
+    ]
+    if prefix:
+        codes.insert(0, ("equal", 0, prefix, 0, prefix))
+    if suffix:
+        codes.append(("equal", len(before) - suffix, len(before), len(after) - suffix, len(after)))
+    return codes
+
+
+def make_delta(source: list[str], target: list[str], max_edits: int = 256) -> list[list]:
+    # Rebuilds target from source: [start, stop] copies source lines, [lines] inserts new ones
+    delta: list[list] = []
+    for tag, i1, i2, j1, j2 in diff_opcodes(source, target, max_edits):
+        if tag == "equal":
+            delta.append([i1, i2])
+        elif j1 < j2:
+            delta.append([target[j1:j2]])
+    return delta
+
+
+def apply_delta(source: list[str], delta: list[list]) -> list[str]:
+    res: list[str] = []
+    for op in delta:
+        if len(op) == 2:
+            res.extend(source[op[0]:op[1]])
+        else:
+            res.extend(op[0])
+    return res
+
+
+def unified_diff(
+        before: list[str],
+        after: list[str],
+        budget: int = 2000,
+        context: int = 3,
+        max_edits: int = 256,
+        fromfile: str = "Before",
+        tofile: str = "After",
+) -> str:
+    codes = diff_opcodes(before, after, max_edits)
+
+    # Group the changes into hunks, keeping up to `context` equal lines around them
+    if not codes:
+        return ""
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = (tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2)
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = (tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context))
+
+    hunks: list[list[tuple[str, int, int, int, int]]] = []
+    hunk: list[tuple[str, int, int, int, int]] = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > 2 * context:
+            hunk.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            hunks.append(hunk)
+            hunk = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        hunk.append((tag, i1, i2, j1, j2))
+    hunks.append(hunk)
+    hunks = [hunk for hunk in hunks if any(code[0] != "equal" for code in hunk)]
+    if not hunks:
+        return ""
+
+    lines: list[str] = [f"--- {fromfile}", f"+++ {tofile}"]
+    size = sum(len(line) + 1 for line in lines)
+    for hunk in hunks:
+        i1, i2, j1, j2 = hunk[0][1], hunk[-1][2], hunk[0][3], hunk[-1][4]
+        hunk_lines = [f"@@ -{format_range(i1, i2)} +{format_range(j1, j2)} @@"]
+        for tag, ci1, ci2, cj1, cj2 in hunk:
+            if tag == "equal":
+                hunk_lines.extend(" " + line for line in before[ci1:ci2])
+                continue
+            hunk_lines.extend("-" + line for line in before[ci1:ci2])
+            hunk_lines.extend("+" + line for line in after[cj1:cj2])
+        for line in hunk_lines:
+            lines.append(line)
+            size += len(line) + 1
+            # Nobody reads past the budget, stop formatting there
+            if size >= budget:
+                return "\n".join(lines)
+    return "\n".join(lines)
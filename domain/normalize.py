@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+
+# A spec is how a Website wants its page cleaned up before it is compared, e.g. "clean;select=div#news, .events"
+# clean: drop scripts, styles and comments, one tag or text per line with collapsed whitespace
+# select: only keep the elements matching one of the comma separated selectors (tag, #id, .class or a mix)
+
+VOID_ELEMENTS = frozenset((
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr",
+))
+SELECTOR = re.compile(r"^([a-zA-Z][a-zA-Z0-9-]*)?((?:[#.][a-zA-Z0-9_-]+)*)$")
+
+
+def make_spec(clean: bool, selector: str | None) -> str:
+    parts: list[str] = []
+    if clean:
+        parts.append("clean")
+    if selector:
+        # Last, the selector may contain anything but it ends the spec
+        parts.append(f"select={selector.strip()}")
+    return ";".join(parts)
+
+
+class Selector:
+    def __init__(self, text: str) -> None:
+        match = SELECTOR.match(text.strip())
+        if match is None or not text.strip():
+            raise ValueError(f"Unsupported selector: {text!r}")
+        self._tag = match.group(1).lower() if match.group(1) else None
+        self._id: str | None = None
+        self._classes: set[str] = set()
+        for part in re.findall(r"[#.][a-zA-Z0-9_-]+", match.group(2)):
+            if part[0] == "#":
+                self._id = part[1:]
+            else:
+                self._classes.add(part[1:])
+
+    def matches(self, tag: str, attrs: list[tuple[str, str | None]]) -> bool:
+        if self._tag is not None and tag != self._tag:
+            return False
+        values = dict(attrs)
+        if self._id is not None and values.get("id") != self._id:
+            return False
+        return self._classes.issubset((values.get("class") or "").split())
+
+
+class Normalizer:
+    def __init__(self, spec: str) -> None:
+        flags, _, selectors = spec.partition("select=")
+        self._clean = "clean" in flags.split(";")
+        self._selectors = [Selector(text) for text in selectors.split(",")] if selectors else []
+
+    def apply(self, html: str) -> str:
+        parser = NormalizingParser(self._clean, self._selectors)
+        parser.feed(html)
+        parser.close()
+        return parser.get_output()
+
+
+class NormalizingParser(HTMLParser):
+    def __init__(self, clean: bool, selectors: list[Selector]) -> None:
+        super().__init__(convert_charrefs=True)
+        self._clean = clean
+        self._selectors = selectors
+        self._output: list[str] = []
+        self._stack: list[str] = []
+        # Depth of the stack when the selected element was opened, None outside of a selected element
+        self._selected: int | None = None if selectors else 0
+        self._skipping: str | None = None
+
+    def get_output(self) -> str:
+        return ("\n" if self._clean else "").join(self._output) + ("\n" if self._clean and self._output else "")
+
+    def emit(self, text: str):
+        if self._selected is None or self._skipping is not None:
+            return
+        if self._clean:
+            text = " ".join(text.split())
+            if not text:
+                return
+        self._output.append(text)
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]):
+        if self._skipping is not None:
+            return
+        if self._clean and tag in ("script", "style"):
+            self._skipping = tag
+            return
+        if self._selected is None and any(selector.matches(tag, attrs) for selector in self._selectors):
+            self._selected = len(self._stack)
+        self.emit(self.get_starttag_text() or f"<{tag}>")
+        if tag not in VOID_ELEMENTS:
+            self._stack.append(tag)
+        elif self._selected == len(self._stack):
+            self._selected = None
+
+    def handle_startendtag(self, tag: str, attrs: list[tuple[str, str | None]]):
+        if self._skipping is not None:
+            return
+        selected = self._selected is None and any(selector.matches(tag, attrs) for selector in self._selectors)
+        if selected:
+            self._selected = len(self._stack)
+        self.emit(self.get_starttag_text() or f"<{tag}/>")
+        if selected:
+            self._selected = None
+
+    def handle_endtag(self, tag: str):
+        if self._skipping is not None:
+            if tag == self._skipping:
+                self._skipping = None
+            return
+        if tag not in self._stack:
+            # Stray end tag, kept as text so nothing silently disappears
+            self.emit(f"</{tag}>")
+            return
+        self.emit(f"</{tag}>")
+        # Closes whatever was left open inside it, like a browser would
+        while self._stack.pop() != tag:
+            pass
+        if self._selected is not None and self._selectors and len(self._stack) <= self._selected:
+            self._selected = None
+
+    def handle_data(self, data: str):
+        self.emit(data)
+
+    def handle_comment(self, data: str):
+        if not self._clean:
+            self.emit(f"<!--{data}-->")
+
+    def handle_decl(self, decl: str):
+        if not self._clean:
+            self.emit(f"<!{decl}>")
+
+
+@lru_cache(maxsize=1024)
+def get_normalizer(spec: str) -> Normalizer:
+    # Compiled once per spec in every process, websites sharing a spec share it
+    return Normalizer(spec)
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import hashlib
+import mmap
+import zlib
+from domain.diff import make_delta, unified_diff
+from domain.normalize import get_normalizer
+
+# Everything here runs in worker processes, so it only takes and returns plain picklable values
+
+
+def digest(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def decode(body: bytes, encoding: str | None) -> str:
+    try:
+        return body.decode(encoding or "utf-8", errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+
+def read_blob(path: str) -> str:
+    # Mapped instead of read, the compressed page is only touched while it is inflated
+    try:
+        with open(path, "rb") as f:
+            if f.seek(0, 2) == 0:
+                return ""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return zlib.decompress(mapped).decode("utf-8", "surrogatepass")
+    except FileNotFoundError:
+        # Replaced in the meantime by a newer version, there is nothing left to diff against
+        return ""
+
+
+def process_update(
+        body: bytes,
+        encoding: str | None,
+        previous_path: str | None,
+        previous_digest: str | None,
+        budget: int,
+        spec: str = "",
+) -> tuple[str | None, str, str | None, list[list] | None]:
+    # Returns the new text (None when unchanged), its digest, the diff against the previous page and the delta
+    # the page store keeps to rebuild the previous page from the new one.
+    # The previous page is only read from disk when the digests differ.
+    text = decode(body, encoding)
+    if spec:
+        # Before hashing, so noise the spec removes never counts as a change
+        text = get_normalizer(spec).apply(text)
+    new_digest = digest(text)
+    if new_digest == previous_digest:
+        return None, new_digest, None, None
+
+    diff = None
+    delta = None
+    if previous_path is not None:
+        previous = read_blob(previous_path)
+        if digest(previous) == new_digest:
+            return None, new_digest, None, None
+        if previous:
+            diff = unified_diff(previous.splitlines(), text.splitlines(), budget=budget)
+            delta = make_delta(text.splitlines(keepends=True), previous.splitlines(keepends=True))
+    return text, new_digest, diff, delta
@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+from collections import deque
+from collections.abc import Collection
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from engine.metrics import METRICS
+
+
+class Budget:
+    # Token bucket of `per_minute` checks, 0 is unlimited
+    def __init__(self, per_minute: float) -> None:
+        self._capacity = per_minute
+        self._rate = per_minute / 60
+        self._tokens = per_minute
+        self._updated: float | None = None
+
+    def refill(self, now: float):
+        if self._updated is not None:
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def is_available(self, now: float) -> bool:
+        if not self._capacity:
+            return True
+        self.refill(now)
+        return self._tokens >= 1
+
+    def take(self, now: float):
+        if self._capacity:
+            self.refill(now)
+            self._tokens -= 1
+
+    def get_wait(self, now: float) -> float:
+        self.refill(now)
+        return max(0.0, (1 - self._tokens) / self._rate)
+
+
+class Waiter:
+    __slots__ = ("guild", "guilds", "enqueued", "future", "running")
+
+    def __init__(self, guild: GuildQueue, guilds: list[GuildQueue], enqueued: float, future: asyncio.Future) -> None:
+        # Queued and limited as the guild that got the least service, charged to all of them
+        self.guild = guild
+        self.guilds = guilds
+        self.enqueued = enqueued
+        self.future = future
+        # Holds one of the slots, false while paused
+        self.running = False
+
+
+class GuildQueue:
+    __slots__ = ("id", "weight", "virtual", "seq", "running", "waiting", "budget")
+
+    def __init__(self, id: int, weight: float, budget: float) -> None:
+        self.id = id
+        self.weight = weight
+        # Service received so far divided by the weight, the guild with the least goes first
+        self.virtual: float = 0
+        # Identifies the live entry of the guild in the heap, older entries are skipped
+        self.seq = 0
+        self.running = 0
+        self.waiting: deque[Waiter] = deque()
+        self.budget = Budget(budget)
+
+    def head(self) -> Waiter | None:
+        # Waiters cancelled while queued are only dropped once they reach the front
+        while self.waiting and self.waiting[0].future.done():
+            self.waiting.popleft()
+        return self.waiting[0] if self.waiting else None
+
+
+class FairQueue:
+    # Weighted fair queuing of the checks across guilds: every guild gets a share of the `concurrency` slots
+    # proportional to its weight however many websites it has. A guild can be held to `guild_concurrency`
+    # checks running and `budget` checks a minute, and a check that waited `latency_target` seconds goes
+    # before any other once its guild is allowed to run it.
+    def __init__(
+            self,
+            concurrency: int = 20,
+            guild_concurrency: int = 0,
+            budget: float = 0,
+            latency_target: float = 30,
+            weights: dict[int, float] | None = None,
+    ) -> None:
+        # Checked up front, a guild weighing nothing would divide by zero and a budget below one check never runs
+        for guild, weight in (weights or {}).items():
+            if weight <= 0:
+                raise ValueError(f"weight of guild {guild} must be positive, got {weight}")
+        if budget != 0 and not budget >= 1:
+            raise ValueError(f"budget must be 0 or at least 1 check a minute, got {budget}")
+        self._concurrency = concurrency
+        # 0 lets a guild use every slot the others leave free
+        self._guild_concurrency = guild_concurrency or concurrency
+        self._budget = budget
+        self._latency_target = latency_target
+        self._weights = weights or {}
+        self._guilds: dict[int, GuildQueue] = {}
+        # (virtual, seq, guild id) of the guilds with waiters
+        self._heap: list[tuple[float, int, int]] = []
+        # Every waiter in arrival order, for the latency target
+        self._arrivals: deque[Waiter] = deque()
+        # Paused checks that want their slot back, they go before any new check
+        self._resumed: deque[Waiter] = deque()
+        self._seq = itertools.count()
+        # Virtual time of the last guild served, guilds coming back from idle start from it
+        self._virtual: float = 0
+        self._running = 0
+        self._waiting = 0
+        self._timer: asyncio.TimerHandle | None = None
+
+    def get_waiting_count(self) -> int:
+        return self._waiting
+
+    def get_running_count(self) -> int:
+        return self._running
+
+    def get_guild(self, id: int) -> GuildQueue:
+        guild = self._guilds.get(id)
+        if guild is None:
+            guild = GuildQueue(id, self._weights.get(id, 1), self._budget)
+            self._guilds[id] = guild
+        return guild
+
+    def push(self, guild: GuildQueue):
+        guild.seq = next(self._seq)
+        heapq.heappush(self._heap, (guild.virtual, guild.seq, guild.id))
+
+    def enqueue(self, guild_ids: Collection[int]) -> Waiter:
+        loop = asyncio.get_running_loop()
+        # Monitors no website watches anymore are still checked, as guild 0
+        guilds = [self.get_guild(id) for id in guild_ids] or [self.get_guild(0)]
+        for guild in guilds:
+            if guild.head() is None:
+                # Idle guilds don't bank the service they did not use
+                guild.virtual = max(guild.virtual, self._virtual)
+        owner = min(guilds, key=lambda guild: guild.virtual)
+        waiter = Waiter(owner, guilds, loop.time(), loop.create_future())
+        if owner.head() is None:
+            self.push(owner)
+        owner.waiting.append(waiter)
+        self._arrivals.append(waiter)
+        self._waiting += 1
+        self.dispatch()
+        return waiter
+
+    def is_eligible(self, guild: GuildQueue, now: float) -> bool:
+        return guild.running < self._guild_concurrency and guild.budget.is_available(now)
+
+    def pick(self, now: float) -> GuildQueue | None:
+        while self._arrivals and self._arrivals[0].future.done():
+            self._arrivals.popleft()
+        if self._arrivals and now - self._arrivals[0].enqueued >= self._latency_target:
+            guild = self._arrivals[0].guild
+            if self.is_eligible(guild, now):
+                return guild
+
+        skipped: list[tuple[float, int, int]] = []
+        res: GuildQueue | None = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            guild = self._guilds[entry[2]]
+            if entry[1] != guild.seq or guild.head() is None:
+                continue
+            if self.is_eligible(guild, now):
+                res = guild
+                break
+            skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return res
+
+    def grant(self, guild: GuildQueue, now: float):
+        waiter = guild.head()
+        guild.waiting.popleft()
+        self._virtual = guild.virtual
+        # A monitor shared by several guilds costs each of them a part of the check
+        for charged in waiter.guilds:
+            charged.virtual += 1 / len(waiter.guilds) / charged.weight
+            if charged.head() is not None:
+                self.push(charged)
+        guild.budget.take(now)
+        self.start(waiter)
+        wait = now - waiter.enqueued
+        METRICS.observe("fair_wait_seconds", wait)
+        if wait > self._latency_target:
+            METRICS.inc("fair_target_missed_total")
+
+    def start(self, waiter: Waiter):
+        waiter.guild.running += 1
+        waiter.running = True
+        self._running += 1
+        self._waiting -= 1
+        waiter.future.set_result(None)
+
+    def dispatch(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        while self._running < self._concurrency and self._resumed:
+            # Already charged and let in, only waiting for a slot to be free
+            waiter = self._resumed.popleft()
+            if not waiter.future.done():
+                self.start(waiter)
+        while self._running < self._concurrency:
+            guild = self.pick(now)
+            if guild is None:
+                break
+            self.grant(guild, now)
+
+        # Guilds held back by their budget only, dispatched again when their next check is allowed
+        if self._running < self._concurrency and self._budget:
+            waits = [
+                guild.budget.get_wait(now)
+                for guild in self._guilds.values()
+                if guild.waiting and guild.running < self._guild_concurrency
+            ]
+            if waits:
+                when = now + min(waits)
+                if self._timer is None or self._timer.when() > when:
+                    if self._timer is not None:
+                        self._timer.cancel()
+                    self._timer = loop.call_at(when, self.wake)
+
+    def wake(self):
+        self._timer = None
+        self.dispatch()
+
+    def release(self, waiter: Waiter):
+        waiter.guild.running -= 1
+        waiter.running = False
+        self._running -= 1
+        self.dispatch()
+
+    async def wait(self, waiter: Waiter):
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.cancelled():
+                self._waiting -= 1
+            else:
+                # Granted just before the cancellation
+                self.release(waiter)
+            raise
+
+    @asynccontextmanager
+    async def slot(self, guild_ids: Collection[int]) -> AsyncIterator[Waiter]:
+        waiter = self.enqueue(guild_ids)
+        await self.wait(waiter)
+        try:
+            yield waiter
+        finally:
+            if waiter.running:
+                self.release(waiter)
+
+    @asynccontextmanager
+    async def paused(self, waiter: Waiter) -> AsyncIterator[None]:
+        # Gives the slot back while the check waits for something the other checks don't need, like its host
+        if not waiter.running:
+            yield
+            return
+        self.release(waiter)
+        try:
+            yield
+        finally:
+            waiter.future = asyncio.get_running_loop().create_future()
+            self._resumed.append(waiter)
+            self._waiting += 1
+            self.dispatch()
+            await self.wait(waiter)
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+from aiohttp import web
+
+Labels = tuple[tuple[str, str], ...]
+
+BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS) -> None:
+        self._buckets = buckets
+        # The last count is for the values past every bucket
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum: float = 0
+        self._count = 0
+
+    def observe(self, value: float):
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self._sum += value
+        self._count += 1
+
+    def get_count(self) -> int:
+        return self._count
+
+    def get_sum(self) -> float:
+        return self._sum
+
+    def get_mean(self) -> float:
+        return self._sum / self._count if self._count else 0
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the quantile, good enough to spot a slow host
+        if not self._count:
+            return 0
+        rank = q * self._count
+        seen = 0
+        for bound, count in zip(self._buckets, self._counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def merge(self, other: Histogram):
+        for index, count in enumerate(other._counts):
+            self._counts[index] += count
+        self._sum += other._sum
+        self._count += other._count
+
+    def get_buckets(self) -> list[tuple[float, int]]:
+        res: list[tuple[float, int]] = []
+        seen = 0
+        for bound, count in zip([*self._buckets, float("inf")], self._counts):
+            seen += count
+            res.append((bound, seen))
+        return res
+
+
+def label_key(labels: dict[str, object]) -> Labels:
+    return tuple((name, str(label)) for name, label in sorted(labels.items()))
+
+
+def format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return f"{value:g}"
+
+
+class Metrics:
+    def __init__(self, prefix: str = "uscitibot") -> None:
+        self._prefix = prefix
+        self._counters: dict[str, dict[Labels, float]] = {}
+        self._histograms: dict[str, dict[Labels, Histogram]] = {}
+        # Read when the metrics are rendered, for values owned by someone else like a queue length
+        self._gauges: dict[str, Callable[[], float]] = {}
+        self._help: dict[str, str] = {}
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def inc(self, name: str, value: float = 1, **labels: object):
+        counter = self._counters.setdefault(name, {})
+        key = label_key(labels)
+        counter[key] = counter.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: object):
+        histograms = self._histograms.setdefault(name, {})
+        key = label_key(labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = Histogram()
+            histograms[key] = histogram
+        histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: object) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def set_gauge(self, name: str, func: Callable[[], float]):
+        self._gauges[name] = func
+
+    def get_counters(self, name: str) -> dict[Labels, float]:
+        return self._counters.get(name, {})
+
+    def get_histograms(self, name: str) -> dict[Labels, Histogram]:
+        return self._histograms.get(name, {})
+
+    def get_histogram(self, name: str) -> Histogram:
+        # All the label sets merged together
+        merged = Histogram()
+        for histogram in self.get_histograms(name).values():
+            merged.merge(histogram)
+        return merged
+
+    def get_gauge(self, name: str) -> float:
+        func = self._gauges.get(name)
+        return func() if func is not None else 0
+
+    def render(self) -> str:
+        # Prometheus text exposition format
+        lines: list[str] = []
+        for name, counter in self._counters.items():
+            full = f"{self._prefix}_{name}"
+            if name in self._help:
+                lines.append(f"# HELP {full} {self._help[name]}")
+            lines.append(f"# TYPE {full} counter")
+            for labels, value in counter.items():
+                lines.append(f"{full}{format_labels(labels)} {format_value(value)}")
+        for name, histograms in self._histograms.items():
+            full = f"{self._prefix}_{name}"
+            if name in self._help:
+                lines.append(f"# HELP {full} {self._help[name]}")
+            lines.append(f"# TYPE {full} histogram")
+            for labels, histogram in histograms.items():
+                for bound, count in histogram.get_buckets():
+                    lines.append(f"{full}_bucket{format_labels(labels, (('le', format_value(bound)),))} {count}")
+                lines.append(f"{full}_sum{format_labels(labels)} {format_value(histogram.get_sum())}")
+                lines.append(f"{full}_count{format_labels(labels)} {histogram.get_count()}")
+        for name, func in self._gauges.items():
+            full = f"{self._prefix}_{name}"
+            if name in self._help:
+                lines.append(f"# HELP {full} {self._help[name]}")
+            lines.append(f"# TYPE {full} gauge")
+            lines.append(f"{full} {format_value(func())}")
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str, port: int) -> web.AppRunner:
+        async def handle(request: web.Request) -> web.Response:
+            return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+METRICS = Metrics()
+METRICS.describe("fetch_seconds", "Time to fetch a page, by host")
+METRICS.describe("fetch_responses_total", "Responses by status, error when the request failed")
+METRICS.describe("fetch_bytes_total", "Bytes of response bodies received")
+METRICS.describe("diff_seconds", "Time to decode, hash and diff a fetched page")
+METRICS.describe("save_seconds", "Time to write the changed domain to disk")
+METRICS.describe("cycle_seconds", "Time to check a batch of due monitors")
+METRICS.describe("poll_lag_seconds", "How late monitors are checked after they are due")
+METRICS.describe("push_total", "Pushes received from hubs and webhooks, by whether their signature was valid")
+METRICS.describe("push_subscriptions_total", "Subscription requests to WebSub hubs, by outcome")
+METRICS.describe("fair_wait_seconds", "Time due checks waited for their guild's turn")
+METRICS.describe("fair_target_missed_total", "Checks that waited longer than the latency target")
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable
+
+
+class RateBucket:
+    # At most `rate` messages every `per` seconds, callers wait for a free slot
+    def __init__(self, rate: int, per: float) -> None:
+        self._rate = rate
+        self._per = per
+        self._sent: list[float] = []
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            self._sent = [time for time in self._sent if time > now - self._per]
+            if len(self._sent) < self._rate:
+                self._sent.append(now)
+                return
+            await asyncio.sleep(self._sent[0] + self._per - now)
+
+
+def split_lines(text: str, limit: int) -> list[str]:
+    # Chunks of whole lines, lines longer than the limit are cut
+    chunks: list[str] = []
+    chunk = ""
+    for line in text.splitlines():
+        while len(line) > limit:
+            if chunk:
+                chunks.append(chunk)
+                chunk = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if chunk and len(chunk) + 1 + len(line) > limit:
+            chunks.append(chunk)
+            chunk = ""
+        chunk = f"{chunk}\n{line}" if chunk else line
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def split_code(text: str, limit: int, language: str = "diff") -> list[str]:
+    opening = f"```{language}\n"
+    closing = "\n```"
+    return [opening + chunk + closing for chunk in split_lines(text, limit - len(opening) - len(closing))]
+
+
+class NotificationDispatcher:
+    def __init__(
+            self,
+            send: Callable[[int, str], Awaitable[None]],
+            window: float = 2,
+            limit: int = 2000,
+            channel_rate: int = 5,
+            channel_per: float = 5,
+            global_rate: int = 50,
+            global_per: float = 1,
+    ) -> None:
+        self._send = send
+        self._window = window
+        self._limit = limit
+        self._channel_rate = channel_rate
+        self._channel_per = channel_per
+        self._global = RateBucket(global_rate, global_per)
+        self._buckets: dict[int, RateBucket] = {}
+        # Pieces of text waiting to be packed into messages, by channel id
+        self._pending: dict[int, list[str]] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+
+    def get_bucket(self, channel_id: int) -> RateBucket:
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            bucket = RateBucket(self._channel_rate, self._channel_per)
+            self._buckets[channel_id] = bucket
+        return bucket
+
+    def get_pending_count(self) -> int:
+        return sum(len(pieces) for pieces in self._pending.values())
+
+    def notify(self, channel_id: int, text: str, code: str | None = None):
+        # Never waits, the message is sent by the worker of the channel
+        pieces = self._pending.setdefault(channel_id, [])
+        pieces.extend(split_lines(text, self._limit))
+        if code:
+            pieces.extend(split_code(code, self._limit))
+        if channel_id not in self._workers:
+            self._workers[channel_id] = asyncio.create_task(self._work(channel_id))
+
+    def pack(self, pieces: list[str]) -> list[str]:
+        messages: list[str] = []
+        message = ""
+        for piece in pieces:
+            if message and len(message) + 1 + len(piece) > self._limit:
+                messages.append(message)
+                message = ""
+            message = f"{message}\n{piece}" if message else piece
+        if message:
+            messages.append(message)
+        return messages
+
+    async def _work(self, channel_id: int):
+        try:
+            while self._pending.get(channel_id):
+                # Updates arriving within the window are sent together
+                await asyncio.sleep(self._window)
+                # Shielded so that close() can cancel the wait without dropping messages being sent
+                await asyncio.shield(self.flush(channel_id))
+        finally:
+            self._workers.pop(channel_id, None)
+
+    async def flush(self, channel_id: int):
+        pieces = self._pending.pop(channel_id, [])
+        bucket = self.get_bucket(channel_id)
+        for message in self.pack(pieces):
+            await bucket.acquire()
+            await self._global.acquire()
+            try:
+                await self._send(channel_id, message)
+            except Exception as e:
+                print(f"Could not notify channel {channel_id}: {e!r}")
+
+    async def close(self):
+        for worker in list(self._workers.values()):
+            worker.cancel()
+        for channel_id in list(self._pending):
+            await self.flush(channel_id)
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Callable, Collection
+from domain.classes import Monitor
+from engine.fairness import FairQueue
+from engine.metrics import METRICS
+from engine.processing import UpdateProcessor
+from engine.scheduler import PollScheduler
+from network.fetcher import AsyncFetcher, HOST_WAIT
+
+
+async def check_fairly(
+        monitor: Monitor,
+        fetcher: AsyncFetcher,
+        processor: UpdateProcessor,
+        fair: FairQueue,
+        guild_ids: Collection[int],
+):
+    async with fair.slot(guild_ids) as turn:
+        # Run as its own task by gather, so only the requests of this check give the turn back while they wait
+        HOST_WAIT.set(lambda: fair.paused(turn))
+        await monitor.check_update(fetcher, processor)
+
+
+async def check_batch(
+        monitors: list[Monitor],
+        fetcher: AsyncFetcher,
+        processor: UpdateProcessor,
+        scheduler: PollScheduler,
+        fair: FairQueue,
+        get_guild_ids: Callable[[Monitor], Collection[int]],
+) -> list[str | None | Exception]:
+    # One batch of due monitors, as the bot, its shards and the benchmarks check it. Returns, for every monitor,
+    # the diff of its update, None when it did not change or the exception its check raised.
+    with METRICS.timer("cycle_seconds"):
+        results = await asyncio.gather(
+            *(check_fairly(monitor, fetcher, processor, fair, get_guild_ids(monitor)) for monitor in monitors),
+            return_exceptions=True,
+        )
+
+    res: list[str | None | Exception] = []
+    for monitor, result in zip(monitors, results):
+        if isinstance(result, Exception):
+            print(f"Could not check {monitor.get_url()}: {result!r}")
+            scheduler.fail(monitor, result)
+            res.append(result)
+            continue
+        update = monitor.is_updated()
+        scheduler.reschedule(monitor, bool(update))
+        res.append(update)
+    return res
@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+
+class UpdateProcessor:
+    def __init__(self, workers: int = 2, inline_limit: int = 64 * 1024) -> None:
+        self._workers = workers
+        self._inline_limit = inline_limit
+        self._pool: ProcessPoolExecutor | None = None
+
+    def get_pool(self) -> ProcessPoolExecutor | None:
+        if self._pool is None and self._workers > 0:
+            # spawn: forking a process that runs an event loop and threads is not safe
+            self._pool = ProcessPoolExecutor(self._workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def run(self, size: int, func: Callable[..., Any], *args: Any) -> Any:
+        # Shipping a small payload to another process costs more than processing it here
+        pool = self.get_pool() if size >= self._inline_limit else None
+        if pool is None:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Callable
+from aiohttp import web
+from domain.classes import PushMonitor
+from engine.metrics import METRICS
+from network.fetcher import AsyncFetcher
+from network.websub import check_signature
+
+
+class PushReceiver:
+    # Listens for WebSub hubs and signed webhooks on <public url>/push/<callback id>, and keeps the
+    # subscriptions of the push monitors to the hubs their websites announce
+    def __init__(
+            self,
+            public_url: str,
+            fetcher: AsyncFetcher,
+            on_push: Callable[[PushMonitor], None],
+            on_lease: Callable[[PushMonitor], None],
+            lease: float = 10 * 24 * 60 * 60,
+            renew_before: float = 24 * 60 * 60,
+            renew_every: float = 60,
+            retry: float = 10 * 60,
+    ) -> None:
+        self._public_url = public_url.rstrip("/")
+        self._fetcher = fetcher
+        self._on_push = on_push
+        self._on_lease = on_lease
+        self._lease = lease
+        self._renew_before = renew_before
+        self._renew_every = renew_every
+        self._retry = retry
+        self._runner: web.AppRunner | None = None
+        self._renewer: asyncio.Task | None = None
+        self._requests: set[asyncio.Task] = set()
+
+    def get_callback(self, monitor: PushMonitor) -> str:
+        return f"{self._public_url}/push/{monitor.get_callback_id()}"
+
+    async def handle_verify(self, request: web.Request) -> web.Response:
+        monitor = PushMonitor.find_callback(request.match_info["id"])
+        mode = request.query.get("hub.mode")
+        topic = request.query.get("hub.topic")
+        challenge = request.query.get("hub.challenge", "")
+
+        if mode == "denied":
+            if monitor is not None and topic == monitor.get_topic():
+                print(f"{monitor.get_hub()} denied the subscription to {topic}: {request.query.get('hub.reason')}")
+                monitor.set_lease_until(0)
+                self._on_lease(monitor)
+            return web.Response()
+        if monitor is None:
+            # Nobody watches the page anymore, the hub is welcome to drop the subscription
+            return web.Response(text=challenge) if mode == "unsubscribe" else web.Response(status=404)
+        # Only subscriptions asked for recently are confirmed, a stray verification could silence the polling
+        if mode != "subscribe" or topic != monitor.get_topic() or not monitor.is_verifiable():
+            return web.Response(status=404)
+
+        try:
+            lease = float(request.query.get("hub.lease_seconds", self._lease))
+        except ValueError:
+            lease = self._lease
+        monitor.set_lease_until(time.time() + lease)
+        monitor.set_requested(0)
+        METRICS.inc("push_subscriptions_total", result="verified")
+        self._on_lease(monitor)
+        return web.Response(text=challenge)
+
+    async def handle_push(self, request: web.Request) -> web.Response:
+        monitor = PushMonitor.find_callback(request.match_info["id"])
+        if monitor is None:
+            # Gone tells the hub to stop sending
+            return web.Response(status=410)
+        body = await request.read()
+        if not check_signature(monitor.get_secret(), body, request.headers):
+            # Still a success, as WebSub asks, so that a forger learns nothing
+            METRICS.inc("push_total", result="bad_signature")
+            return web.Response(status=202)
+        # The body is whatever the hub distributes, the page itself is fetched by the check
+        METRICS.inc("push_total", result="accepted")
+        monitor.push_received()
+        self._on_push(monitor)
+        return web.Response(status=202)
+
+    async def subscribe(self, monitor: PushMonitor):
+        hub = monitor.get_hub()
+        if hub is None:
+            return
+        monitor.set_requested(time.time())
+        try:
+            res = await self._fetcher.post(hub, {
+                "hub.mode": "subscribe",
+                "hub.topic": monitor.get_topic(),
+                "hub.callback": self.get_callback(monitor),
+                "hub.secret": monitor.get_secret(),
+                "hub.lease_seconds": str(int(self._lease)),
+            })
+        except Exception as e:
+            print(f"Could not subscribe to {monitor.get_topic()} on {hub}: {e!r}")
+            METRICS.inc("push_subscriptions_total", result="error")
+            return
+        if not res.ok:
+            print(f"{hub} refused the subscription to {monitor.get_topic()} with status {res.status}")
+            METRICS.inc("push_subscriptions_total", result="refused")
+            return
+        # The subscription only counts once the hub verified it with handle_verify
+        METRICS.inc("push_subscriptions_total", result="requested")
+
+    def renew(self):
+        now = time.time()
+        for monitor in PushMonitor.get_push_monitors():
+            if monitor.get_hub() is None or not monitor.get_websites():
+                continue
+            if monitor.get_lease_until() - now > self._renew_before or now - monitor.get_requested() < self._retry:
+                continue
+            task = asyncio.create_task(self.subscribe(monitor))
+            self._requests.add(task)
+            task.add_done_callback(self._requests.discard)
+
+    async def renew_forever(self):
+        while True:
+            self.renew()
+            await asyncio.sleep(self._renew_every)
+
+    def get_active_count(self) -> int:
+        return sum(monitor.is_push_active() for monitor in PushMonitor.get_push_monitors())
+
+    async def start(self, host: str, port: int):
+        app = web.Application()
+        app.router.add_get("/push/{id}", self.handle_verify)
+        app.router.add_post("/push/{id}", self.handle_push)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._renewer = asyncio.create_task(self.renew_forever())
+
+    async def close(self):
+        if self._renewer is not None:
+            self._renewer.cancel()
+        for task in list(self._requests):
+            task.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from domain.classes import Monitor
+from engine.metrics import METRICS
+from network.fetcher import CircuitOpen
+
+
+class PollScheduler:
+    def __init__(
+            self,
+            min_interval: float = 60,
+            max_interval: float = 6 * 60 * 60,
+            jitter: float = 0.1,
+            only_watched: bool = True,
+    ) -> None:
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._jitter = jitter
+        # Skip monitors that lost all their websites without being removed
+        self._only_watched = only_watched
+        self._queue: list[tuple[float, int, Monitor]] = []
+        # Due time of the live entry of every scheduled monitor, older heap entries are skipped
+        self._due: dict[Monitor, float] = {}
+        # Poked while they were being checked, checked again right after
+        self._poked: set[Monitor] = set()
+        # Dispatched by next_due until they are rescheduled, added again only then so no check runs twice
+        self._running: set[Monitor] = set()
+        # Removed while they were being checked, not rescheduled
+        self._dropped: set[Monitor] = set()
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+
+    def now(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    def clamp(self, interval: float) -> float:
+        return min(self._max_interval, max(self._min_interval, interval))
+
+    def schedule(self, monitor: Monitor, delay: float):
+        # Never before the server says the page can change, but never later than the longest interval either
+        wait = min(self._max_interval, monitor.get_not_before() - time.time())
+        self.enqueue(monitor, self.now() + max(delay, wait))
+
+    def enqueue(self, monitor: Monitor, due: float):
+        self._due[monitor] = due
+        heapq.heappush(self._queue, (due, next(self._counter), monitor))
+        self._wakeup.set()
+
+    def add(self, monitor: Monitor):
+        if monitor in self._running:
+            self._dropped.discard(monitor)
+            return
+        if monitor in self._due:
+            return
+        interval = self.clamp(monitor.get_interval())
+        monitor.set_interval(interval)
+        if not monitor.has_baseline():
+            # Fetch missing baselines right away, the fetcher bounds how many run in parallel
+            self.schedule(monitor, 0)
+        else:
+            # Spread the others over their whole interval instead of checking them all at once
+            self.schedule(monitor, random.uniform(0, interval))
+
+    def get_scheduled_count(self) -> int:
+        return len(self._due)
+
+    def get_min_interval(self) -> float:
+        return self._min_interval
+
+    def remove(self, monitor: Monitor):
+        self._due.pop(monitor, None)
+        self._poked.discard(monitor)
+        if monitor in self._running:
+            self._dropped.add(monitor)
+
+    def finish(self, monitor: Monitor) -> bool:
+        # False when the monitor was removed while it was being checked
+        self._running.discard(monitor)
+        if monitor in self._dropped:
+            self._dropped.discard(monitor)
+            return False
+        return True
+
+    def poke(self, monitor: Monitor):
+        # The website said it changed, it is checked now whatever its interval and caching headers say
+        if monitor in self._due:
+            self.enqueue(monitor, self.now())
+        else:
+            self._poked.add(monitor)
+
+    def update(self, monitor: Monitor):
+        # The monitors are checked in this process, their state is already up to date
+        pass
+
+    def reschedule(self, monitor: Monitor, updated: bool):
+        if not self.finish(monitor):
+            return
+        monitor.reset_failures()
+        interval = monitor.get_interval()
+        if updated:
+            interval /= 2
+        else:
+            interval *= 1.25
+        interval = self.clamp(interval)
+        monitor.set_interval(interval)
+        if monitor in self._poked:
+            self._poked.discard(monitor)
+            self.enqueue(monitor, self.now())
+        elif monitor.is_push_active():
+            # Pushed changes are checked as they come, polling only catches what the website failed to push
+            self.schedule(monitor, self._max_interval)
+        else:
+            self.schedule(monitor, interval * random.uniform(1 - self._jitter, 1 + self._jitter))
+
+    def fail(self, monitor: Monitor, error: Exception):
+        if not self.finish(monitor):
+            return
+        self._poked.discard(monitor)
+        if isinstance(error, CircuitOpen):
+            # The whole host is cooling down, which is not held against this monitor
+            self.schedule(monitor, error.remaining)
+            return
+        # Exponential backoff, kept in not_before so that it survives a restart
+        failures = monitor.add_failure()
+        delay = self.clamp(monitor.get_interval() * 2 ** min(failures, 16))
+        monitor.set_not_before(time.time() + delay)
+        self.schedule(monitor, delay)
+
+    async def next_due(self) -> list[Monitor]:
+        while True:
+            while self._queue and self._due.get(self._queue[0][2]) != self._queue[0][0]:
+                heapq.heappop(self._queue)
+
+            if self._queue:
+                delay = self._queue[0][0] - self.now()
+                if delay <= 0:
+                    break
+            else:
+                delay = None
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+        now = self.now()
+        res: list[Monitor] = []
+        while self._queue and self._queue[0][0] <= now:
+            due, _, monitor = heapq.heappop(self._queue)
+            if self._due.get(monitor) != due:
+                continue
+            del self._due[monitor]
+            METRICS.observe("poll_lag_seconds", now - due)
+            if monitor.get_websites() or not self._only_watched:
+                self._running.add(monitor)
+                res.append(monitor)
+        return res
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import _csv
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+import queue
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+from pathlib import Path
+from typing import Any, AsyncIterator
+import domain.classes
+from domain.classes import ETagMonitor, IndexedMonitor, Monitor, PushMonitor
+from engine.fairness import FairQueue
+from engine.processing import UpdateProcessor
+from engine.scheduler import PollScheduler
+from engine.polling import check_batch
+from network.fetcher import AsyncFetcher
+from persistence.blobs import BlobStore
+
+
+class HashRing:
+    # Consistent hashing: a shard joining or leaving only moves the urls next to its points on the ring
+    def __init__(self, replicas: int = 64) -> None:
+        self._replicas = replicas
+        self._points: list[int] = []
+        self._shards: dict[int, int] = {}
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], "big")
+
+    def add(self, shard: int):
+        for replica in range(self._replicas):
+            point = self.hash(f"{shard}-{replica}")
+            bisect.insort(self._points, point)
+            self._shards[point] = shard
+
+    def remove(self, shard: int):
+        for replica in range(self._replicas):
+            point = self.hash(f"{shard}-{replica}")
+            if self._shards.pop(point, None) is not None:
+                self._points.remove(point)
+
+    def get_shards(self) -> set[int]:
+        return set(self._shards.values())
+
+    def get_shard(self, key: str) -> int | None:
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, self.hash(key)) % len(self._points)
+        return self._shards[self._points[index]]
+
+
+async def shard_main(shard: int, commands: Queue, events: Queue, options: dict[str, Any]):
+    # The bot process is the only one writing the page store, the worker only reads the previous pages
+    for monitor_class, root in options["stores"].items():
+        getattr(domain.classes, monitor_class).store = BlobStore(Path(root))
+    IndexedMonitor.index_max_age = options["index_max_age"]
+    ETagMonitor.save_pages = False
+    ETagMonitor.diff_budget = options["diff_budget"]
+    ETagMonitor.head_probe_size = options["head_probe_size"]
+    fetcher = AsyncFetcher(**options["fetcher"])
+    processor = UpdateProcessor(workers=0)
+    # Monitors in a worker have no websites, they are dropped by the bot instead
+    scheduler = PollScheduler(**options["scheduler"], only_watched=False)
+    fair = FairQueue(**options["fair"])
+    monitors: dict[tuple[str, str], Monitor] = {}
+    # Guilds of the websites of every monitor, as the bot last sent them
+    guilds: dict[Monitor, list[int]] = {}
+    checks: set[asyncio.Task] = set()
+
+    async def check(due: list[Monitor]):
+        results = await check_batch(due, fetcher, processor, scheduler, fair, lambda monitor: guilds.get(monitor, []))
+        for monitor, result in zip(due, results):
+            events.put((
+                "checked",
+                shard,
+                monitor.__class__.__name__,
+                monitor.get_key(),
+                monitor.get_data(),
+                None if isinstance(result, Exception) else result,
+                # Set whenever the page changed, including the first page which has no diff to notify
+                monitor.take_content(),
+            ))
+
+    async def poll():
+        while True:
+            due = await scheduler.next_due()
+            task = asyncio.create_task(check(due))
+            checks.add(task)
+            task.add_done_callback(checks.discard)
+
+    poller = asyncio.create_task(poll())
+    try:
+        while True:
+            command = await asyncio.to_thread(commands.get)
+            if command[0] == "stop":
+                break
+            _, monitor_class, monitor_key, *arguments = command
+            key = (monitor_class, monitor_key)
+            if command[0] == "add" and key not in monitors:
+                url, spec, data, server_ids = arguments
+                monitor = getattr(domain.classes, monitor_class)(url, spec)
+                monitor.set_data(next(_csv.reader([data])))
+                monitors[key] = monitor
+                guilds[monitor] = server_ids
+                scheduler.add(monitor)
+            elif command[0] == "remove" and key in monitors:
+                monitor = monitors.pop(key)
+                guilds.pop(monitor, None)
+                scheduler.remove(monitor)
+            elif command[0] == "poke" and key in monitors:
+                monitor = monitors[key]
+                if isinstance(monitor, PushMonitor):
+                    monitor.push_received()
+                scheduler.poke(monitor)
+            elif command[0] == "update" and key in monitors:
+                data, server_ids = arguments
+                monitors[key].set_data(next(_csv.reader([data])))
+                guilds[monitors[key]] = server_ids
+    finally:
+        poller.cancel()
+        await fetcher.close()
+
+
+def run_shard(shard: int, commands: Queue, events: Queue, options: dict[str, Any]):
+    asyncio.run(shard_main(shard, commands, events, options))
+
+
+class ShardedPoller:
+    # Stands in for the PollScheduler of the bot: monitors are checked by worker processes,
+    # the bot only receives what they found
+    def __init__(self, shards: int, options: dict[str, Any]) -> None:
+        self._context = multiprocessing.get_context("spawn")
+        self._options = options
+        self._ring = HashRing()
+        self._events: Queue = self._context.Queue()
+        self._workers: dict[int, tuple[BaseProcess, Queue]] = {}
+        self._owners: dict[Monitor, int] = {}
+        self._next_shard = 0
+        for _ in range(shards):
+            self.join()
+
+    def get_scheduled_count(self) -> int:
+        return len(self._owners)
+
+    def get_min_interval(self) -> float:
+        return self._options["scheduler"].get("min_interval", 60)
+
+    def get_shard_count(self) -> int:
+        return len(self._workers)
+
+    def send(self, shard: int, command: tuple):
+        worker = self._workers.get(shard)
+        if worker is not None:
+            worker[1].put(command)
+
+    def add(self, monitor: Monitor):
+        if monitor in self._owners:
+            # Another website of the monitor, maybe in another guild
+            self.update(monitor)
+            return
+        shard = self._ring.get_shard(monitor.get_key())
+        self._owners[monitor] = shard
+        self.send(shard, (
+            "add",
+            monitor.__class__.__name__,
+            monitor.get_key(),
+            monitor.get_url(),
+            monitor.get_spec(),
+            monitor.get_data(),
+            sorted(monitor.get_server_ids()),
+        ))
+
+    def remove(self, monitor: Monitor):
+        shard = self._owners.pop(monitor, None)
+        if shard is not None:
+            self.send(shard, ("remove", monitor.__class__.__name__, monitor.get_key()))
+
+    def poke(self, monitor: Monitor):
+        shard = self._owners.get(monitor)
+        if shard is not None:
+            self.send(shard, ("poke", monitor.__class__.__name__, monitor.get_key()))
+
+    def update(self, monitor: Monitor):
+        # The bot changed the state of the monitor, like the lease of a push subscription or its websites
+        shard = self._owners.get(monitor)
+        if shard is not None:
+            self.send(shard, (
+                "update",
+                monitor.__class__.__name__,
+                monitor.get_key(),
+                monitor.get_data(),
+                sorted(monitor.get_server_ids()),
+            ))
+
+    def rebalance(self):
+        # The state of the monitors in the bot is kept up to date by the events, so it is handed to the new owner
+        for monitor, shard in list(self._owners.items()):
+            owner = self._ring.get_shard(monitor.get_key())
+            if owner != shard:
+                self.remove(monitor)
+                self.add(monitor)
+
+    def join(self) -> int:
+        shard = self._next_shard
+        self._next_shard += 1
+        commands: Queue = self._context.Queue()
+        process = self._context.Process(
+            target=run_shard,
+            args=(shard, commands, self._events, self._options),
+            name=f"shard-{shard}",
+            daemon=True,
+        )
+        process.start()
+        self._workers[shard] = (process, commands)
+        self._ring.add(shard)
+        self.rebalance()
+        return shard
+
+    def leave(self, shard: int):
+        worker = self._workers.get(shard)
+        if worker is None:
+            return
+        self._ring.remove(shard)
+        if worker[0].is_alive():
+            worker[1].put(("stop",))
+        del self._workers[shard]
+        if self._workers:
+            self.rebalance()
+
+    def replace_dead(self):
+        for shard, (process, _) in list(self._workers.items()):
+            if not process.is_alive():
+                print(f"Shard {shard} stopped with exit code {process.exitcode}, replacing it")
+                self.leave(shard)
+                self.join()
+
+    async def events(self) -> AsyncIterator[tuple[Monitor, list[str], str | None, tuple[str, list[list] | None, str | None] | None]]:
+        while True:
+            self.replace_dead()
+            try:
+                event = await asyncio.to_thread(self._events.get, True, 1)
+            except queue.Empty:
+                continue
+            # Results of a shard that gave up the monitor in the meantime are stale
+            monitor = Monitor.find(getattr(domain.classes, event[2]), event[3])
+            if monitor is None or self._owners.get(monitor) != event[1]:
+                continue
+            _, _, _, _, data, update, content = event
+            yield monitor, next(_csv.reader([data])), update, content
+
+    async def close(self):
+        processes = [process for process, _ in self._workers.values()]
+        for shard in list(self._workers):
+            self.leave(shard)
+        for process in processes:
+            await asyncio.to_thread(process.join, 5)
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from collections.abc import Mapping
+from email.utils import parsedate_to_datetime
+
+
+def parse_date(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_cache_control(value: str | None) -> dict[str, str | None]:
+    directives: dict[str, str | None] = {}
+    for part in (value or "").split(","):
+        name, _, argument = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"') if argument else None
+    return directives
+
+
+def freshness_lifetime(headers: Mapping[str, str]) -> float:
+    # Seconds the response stays fresh from now, 0 when it must be revalidated right away
+    directives = parse_cache_control(headers.get("Cache-Control"))
+    if "no-store" in directives or "no-cache" in directives:
+        return 0
+    try:
+        age = float(headers.get("Age", 0))
+    except ValueError:
+        age = 0
+
+    if directives.get("max-age") is not None:
+        try:
+            return max(0.0, float(directives["max-age"]) - age)
+        except ValueError:
+            return 0
+
+    # Expires is relative to the clock of the server, which is what Date is for
+    expires = parse_date(headers.get("Expires"))
+    date = parse_date(headers.get("Date"))
+    if expires is None or date is None:
+        return 0
+    return max(0.0, expires - date - age)
+
+
+def retry_after(headers: Mapping[str, str], now: float) -> float | None:
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    when = parse_date(value)
+    if when is None:
+        return None
+    date = parse_date(headers.get("Date"))
+    return max(0.0, when - (date if date is not None else now))
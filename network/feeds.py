@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Collection
+from contextlib import nullcontext
+from typing import TYPE_CHECKING
+from urllib.parse import urljoin
+from xml.etree.ElementTree import Element, ParseError, XMLPullParser
+from network.fetcher import HOST_WAIT
+
+if TYPE_CHECKING:
+    from network.fetcher import AsyncFetcher
+
+# Elements listing one page in a sitemap, an Atom feed and an RSS feed
+ENTRY_TAGS = frozenset(("url", "entry", "item"))
+# Their children telling when the page last changed, dc:date included
+DATE_TAGS = frozenset(("lastmod", "updated", "pubDate", "date"))
+
+
+def local_name(tag: str) -> str:
+    return tag.rpartition("}")[2]
+
+
+class IndexParser:
+    # Incremental parser of sitemaps and feeds, fed as the document is downloaded.
+    # Keeps url -> last change for the watched urls only, every other entry is dropped once read.
+    def __init__(self, base: str, watched: Collection[str]) -> None:
+        self._base = base
+        self._watched = watched
+        self._parser = XMLPullParser(events=("end",))
+        self._entries: dict[str, str] = {}
+        # Raised by close, raising while the document is downloaded would count as a failure of the host
+        self._error: ParseError | None = None
+
+    def feed(self, data: bytes):
+        if self._error is not None:
+            return
+        try:
+            self._parser.feed(data)
+            self.read_events()
+        except ParseError as e:
+            self._error = e
+
+    def close(self) -> dict[str, str]:
+        if self._error is not None:
+            raise self._error
+        self._parser.close()
+        self.read_events()
+        return self._entries
+
+    def read_events(self):
+        for _, element in self._parser.read_events():
+            if local_name(element.tag) in ENTRY_TAGS:
+                self.add(element)
+                element.clear()
+
+    def add(self, element: Element):
+        url: str | None = None
+        date: str | None = None
+        for child in element:
+            name = local_name(child.tag)
+            if name == "loc" or (name == "link" and (child.text or "").strip()):
+                url = urljoin(self._base, (child.text or "").strip())
+            elif name == "link" and child.get("href") and child.get("rel", "alternate") == "alternate":
+                url = urljoin(self._base, child.get("href"))
+            elif name in DATE_TAGS and (child.text or "").strip():
+                date = child.text.strip()
+        # Without a date the index says nothing about the page, which is then fetched as usual
+        if url in self._watched and date is not None:
+            self._entries[url] = date
+
+
+class PageIndex:
+    # A sitemap or feed shared by the monitors of the pages it lists: fetched once for all of them
+    # and reused for max_age seconds, the pages are only fetched when their date in it changes
+    _indexes: dict[str, PageIndex] = {}
+
+    def __init__(self, url: str) -> None:
+        self._url = url
+        # Monitors of the same page with different normalizers each watch it
+        self._watched: dict[str, int] = {}
+        self._entries: dict[str, str] = {}
+        self._etag: str | None = None
+        self._last_modified: str | None = None
+        self._fetched: float | None = None
+        self._refresh: asyncio.Future | None = None
+
+    @staticmethod
+    def get(url: str) -> PageIndex:
+        index = PageIndex._indexes.get(url)
+        if index is None:
+            index = PageIndex(url)
+            PageIndex._indexes[url] = index
+        return index
+
+    def get_url(self) -> str:
+        return self._url
+
+    def watch(self, url: str):
+        self._watched[url] = self._watched.get(url, 0) + 1
+        if self._watched[url] == 1:
+            # The entries only cover the urls watched when the index was read, so it is read whole again
+            self._etag = self._last_modified = None
+
+    def unwatch(self, url: str):
+        count = self._watched.pop(url, 0) - 1
+        if count > 0:
+            self._watched[url] = count
+        elif not self._watched:
+            PageIndex._indexes.pop(self._url, None)
+
+    async def lookup(self, url: str, fetcher: AsyncFetcher, max_age: float) -> str | None:
+        # Date of the last change of the page, None when the index does not list it
+        now = asyncio.get_running_loop().time()
+        if self._fetched is None or now - self._fetched >= max_age:
+            if self._refresh is None or self._refresh.done():
+                self._refresh = asyncio.ensure_future(self.refresh(fetcher))
+            # Waited for without the turn of the check: the refresh may need the host of a check that wants one back
+            host_wait = HOST_WAIT.get()
+            async with host_wait() if host_wait is not None else nullcontext():
+                # Shielded, a check that is cancelled must not cancel the refresh the others wait for
+                await asyncio.shield(self._refresh)
+        return self._entries.get(url)
+
+    async def refresh(self, fetcher: AsyncFetcher):
+        # Copied from the check that started it, whose turn is not the refresh's to give back
+        HOST_WAIT.set(None)
+        headers: dict[str, str] = {}
+        if self._etag is not None:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified is not None:
+            headers["If-Modified-Since"] = self._last_modified
+        parser = IndexParser(self._url, self._watched)
+        try:
+            res = await fetcher.request("GET", self._url, headers, sink=parser.feed)
+            if res.status == 304:
+                return
+            if not res.ok:
+                print(f"Could not read the index {self._url}: status {res.status}")
+                self._entries = {}
+                return
+            self._entries = parser.close()
+            self._etag = res.headers.get("ETag")
+            self._last_modified = res.headers.get("Last-Modified")
+        except Exception as e:
+            # The pages are fetched one by one until the index works again
+            print(f"Could not read the index {self._url}: {e!r}")
+            self._entries = {}
+            self._etag = self._last_modified = None
+        finally:
+            self._fetched = asyncio.get_running_loop().time()
@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import time
+from collections.abc import Callable, Mapping
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import AsyncContextManager
+from urllib.parse import urlsplit
+import aiohttp
+from engine.metrics import METRICS
+from network.caching import retry_after
+
+try:
+    import brotli
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    # aiohttp only decompresses brotli when the brotli package is installed
+    ACCEPT_ENCODING = "gzip, deflate"
+
+# Entered while a request of the current task waits for its host, to give back what the caller holds that requests
+# to other hosts could use, like the turn of its guilds: a busy or deferred host then holds back nobody else
+HOST_WAIT: ContextVar[Callable[[], AsyncContextManager[None]] | None] = ContextVar("HOST_WAIT", default=None)
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class BadStatus(Exception):
+    def __init__(self, url: str, status: int) -> None:
+        super().__init__(f"{url} answered with status {status}")
+        self.status = status
+
+
+class CircuitOpen(Exception):
+    def __init__(self, host: str, remaining: float) -> None:
+        super().__init__(f"{host} is failing, next attempt in {remaining:.0f}s")
+        self.remaining = remaining
+
+
+class CircuitBreaker:
+    # Stops sending requests to a host after `threshold` failures in a row. Once the cooldown is over a single
+    # request probes the host: success closes the circuit, failure opens it again for twice as long.
+    def __init__(self, threshold: int = 3, cooldown: float = 30, max_cooldown: float = 60 * 60) -> None:
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._max_cooldown = max_cooldown
+        self._failures = 0
+        self._open_until: float = 0
+        self._probing = False
+
+    def is_open(self) -> bool:
+        return self._failures >= self._threshold
+
+    def get_cooldown(self) -> float:
+        return min(self._max_cooldown, self._cooldown * 2 ** (self._failures - self._threshold))
+
+    def allow(self, host: str, now: float) -> bool:
+        # True when the request is the probe, which has to end it with end_probe whatever happens to it
+        if not self.is_open():
+            return False
+        if now < self._open_until:
+            raise CircuitOpen(host, self._open_until - now)
+        if self._probing:
+            raise CircuitOpen(host, self._cooldown)
+        self._probing = True
+        return True
+
+    def end_probe(self):
+        # A probe that was cancelled or failed before it was answered lets the next request probe instead
+        self._probing = False
+
+    def record_success(self):
+        self._failures = 0
+        self._open_until = 0
+        self._probing = False
+
+    def record_failure(self, now: float):
+        self._failures += 1
+        self._probing = False
+        if self.is_open():
+            self._open_until = now + self.get_cooldown()
+
+
+class Response:
+    def __init__(
+            self,
+            status: int,
+            headers: Mapping[str, str],
+            body: bytes,
+            charset: str | None,
+            digest: bytes,
+    ) -> None:
+        self.status = status
+        self.headers = headers
+        # Left undecoded, decoding is done by the UpdateProcessor
+        self.body = body
+        self.charset = charset
+        # SHA-256 of the body, hashed while it was downloaded
+        self.digest = digest
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 400
+
+
+class HostLimiter:
+    def __init__(self, concurrency: int, spacing: float) -> None:
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._spacing = spacing
+        self._next_slot: float = 0
+        self._breaker = CircuitBreaker()
+
+    def get_breaker(self) -> CircuitBreaker:
+        return self._breaker
+
+    def is_ready(self) -> bool:
+        return not self._semaphore.locked() and self._next_slot <= asyncio.get_running_loop().time()
+
+    async def acquire(self):
+        await self._semaphore.acquire()
+        try:
+            await self.wait_turn()
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    def release(self):
+        self._semaphore.release()
+
+    def defer(self, delay: float):
+        # The host asked to be left alone, nobody gets a slot before the delay is over
+        self._next_slot = max(self._next_slot, asyncio.get_running_loop().time() + delay)
+
+    async def wait_turn(self):
+        # Reserve the next free slot first, so concurrent callers queue up one spacing apart
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self._spacing
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class AsyncFetcher:
+    def __init__(
+            self,
+            concurrency: int = 20,
+            timeout: float = 10,
+            host_concurrency: int = 2,
+            host_spacing: float = 0.5,
+            max_body_size: int = 5 * 1024 * 1024,
+            chunk_size: int = 64 * 1024,
+    ) -> None:
+        self._concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # A host that does not even accept the connection should not hold a slot for the whole timeout
+        self._timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=min(timeout, 5))
+        self._host_concurrency = host_concurrency
+        self._host_spacing = host_spacing
+        self._max_body_size = max_body_size
+        self._chunk_size = chunk_size
+        self._hosts: dict[str, HostLimiter] = {}
+        self._session: aiohttp.ClientSession | None = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._concurrency,
+                limit_per_host=self._host_concurrency,
+                keepalive_timeout=60,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self._timeout)
+        return self._session
+
+    def get_host_limiter(self, host: str) -> HostLimiter:
+        limiter = self._hosts.get(host)
+        if limiter is None:
+            limiter = HostLimiter(self._host_concurrency, self._host_spacing)
+            self._hosts[host] = limiter
+        return limiter
+
+    async def get(self, url: str, headers: dict[str, str] | None = None) -> Response:
+        return await self.request("GET", url, headers)
+
+    async def head(self, url: str, headers: dict[str, str] | None = None) -> Response:
+        return await self.request("HEAD", url, headers)
+
+    async def post(self, url: str, data: Mapping[str, str], headers: dict[str, str] | None = None) -> Response:
+        # Sent form encoded
+        return await self.request("POST", url, headers, data)
+
+    async def read_body(
+            self,
+            res: aiohttp.ClientResponse,
+            sink: Callable[[bytes], None] | None = None,
+    ) -> tuple[bytes, bytes, int]:
+        # Streamed and capped after decompression, so neither a huge page nor a compression bomb fills the memory
+        if res.content_length is not None and res.content_length > self._max_body_size:
+            raise BodyTooLarge(f"{res.content_length} bytes announced, the limit is {self._max_body_size}")
+        chunks: list[bytes] = []
+        size = 0
+        digest = hashlib.sha256()
+        async for chunk in res.content.iter_chunked(self._chunk_size):
+            size += len(chunk)
+            if size > self._max_body_size:
+                raise BodyTooLarge(f"more than {self._max_body_size} bytes received")
+            digest.update(chunk)
+            if sink is not None:
+                # Handed over as it arrives, the body is never kept whole
+                sink(chunk)
+            else:
+                chunks.append(chunk)
+        return b"".join(chunks), digest.digest(), size
+
+    async def request(
+            self,
+            method: str,
+            url: str,
+            headers: dict[str, str] | None = None,
+            data: Mapping[str, str] | None = None,
+            sink: Callable[[bytes], None] | None = None,
+    ) -> Response:
+        headers = {"Accept-Encoding": ACCEPT_ENCODING, **(headers or {})}
+        host = urlsplit(url).netloc.lower()
+        limiter = self.get_host_limiter(host)
+        breaker = limiter.get_breaker()
+        try:
+            probing = breaker.allow(host, asyncio.get_running_loop().time())
+        except CircuitOpen:
+            METRICS.inc("fetch_responses_total", status="circuit_open")
+            raise
+        # Nothing is given back when the host is ready, another check would only take it meanwhile
+        host_wait = HOST_WAIT.get() if not limiter.is_ready() else None
+        acquired = False
+        try:
+            async with host_wait() if host_wait is not None else nullcontext():
+                await limiter.acquire()
+                acquired = True
+            async with self._semaphore:
+                # Timed once the request may start, waiting for a slot is not the host's fault
+                start = time.perf_counter()
+                try:
+                    async with self.get_session().request(method, url, headers=headers, data=data) as res:
+                        body, digest, size = await self.read_body(res, sink)
+                except BodyTooLarge:
+                    # The page is the problem, not the host
+                    breaker.record_success()
+                    METRICS.inc("fetch_responses_total", status="too_large")
+                    raise
+                except Exception:
+                    breaker.record_failure(asyncio.get_running_loop().time())
+                    METRICS.inc("fetch_responses_total", status="error")
+                    raise
+                finally:
+                    METRICS.observe("fetch_seconds", time.perf_counter() - start, host=host)
+                METRICS.inc("fetch_responses_total", status=res.status)
+                METRICS.inc("fetch_bytes_total", size)
+                if res.status >= 500 and res.status != 503:
+                    breaker.record_failure(asyncio.get_running_loop().time())
+                else:
+                    breaker.record_success()
+                if res.status in (429, 503):
+                    delay = retry_after(res.headers, time.time())
+                    if delay is not None:
+                        limiter.defer(delay)
+                return Response(res.status, res.headers, body, res.charset, digest)
+        finally:
+            if acquired:
+                limiter.release()
+            if probing:
+                breaker.end_probe()
+
+    def get_open_circuit_count(self) -> int:
+        return sum(limiter.get_breaker().is_open() for limiter in self._hosts.values())
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
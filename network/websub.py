@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import hmac
+import re
+from collections.abc import Iterable, Mapping
+from urllib.parse import urljoin
+
+LINK_HEADER = re.compile(r"<([^>]*)>\s*((?:;[^;,]*)*)")
+LINK_ELEMENT = re.compile(rb"<(?:atom:)?link\b[^>]*>", re.IGNORECASE)
+ATTRIBUTE = re.compile(rb"""([a-zA-Z-]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+SIGNATURE_ALGORITHMS = frozenset(("sha1", "sha256", "sha384", "sha512"))
+
+
+def parse_links(values: Iterable[str], base: str) -> dict[str, str]:
+    # rel -> absolute url of the first Link header with that rel
+    links: dict[str, str] = {}
+    for value in values:
+        for match in LINK_HEADER.finditer(value):
+            url, params = match.groups()
+            for param in params.split(";"):
+                name, _, argument = param.strip().partition("=")
+                if name.lower() == "rel":
+                    for rel in argument.strip('"').lower().split():
+                        links.setdefault(rel, urljoin(base, url))
+    return links
+
+
+def find_links(body: bytes, base: str) -> dict[str, str]:
+    # Same for the <link> elements of an HTML page or an Atom/RSS feed, where most publishers announce their hub
+    links: dict[str, str] = {}
+    for element in LINK_ELEMENT.finditer(body):
+        attributes = {
+            name.lower(): double or single
+            for name, double, single in ATTRIBUTE.findall(element.group())
+        }
+        href = attributes.get(b"href")
+        if href is None:
+            continue
+        for rel in attributes.get(b"rel", b"").lower().split():
+            links.setdefault(rel.decode("ascii", "replace"), urljoin(base, href.decode("utf-8", "replace")))
+    return links
+
+
+def sign(secret: str, body: bytes, algorithm: str = "sha256") -> str:
+    return f"{algorithm}={hmac.new(secret.encode(), body, algorithm).hexdigest()}"
+
+
+def check_signature(secret: str, body: bytes, headers: Mapping[str, str]) -> bool:
+    # X-Hub-Signature is the header of WebSub, X-Hub-Signature-256 the one of most webhooks
+    for header in ("X-Hub-Signature-256", "X-Hub-Signature"):
+        value = headers.get(header)
+        if value is None:
+            continue
+        algorithm, _, signature = value.partition("=")
+        algorithm = algorithm.lower()
+        if algorithm not in SIGNATURE_ALGORITHMS:
+            return False
+        expected = hmac.new(secret.encode(), body, algorithm).hexdigest()
+        return hmac.compare_digest(expected, signature.strip().lower())
+    return False
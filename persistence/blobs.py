@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import zlib
+from datetime import datetime
+from pathlib import Path
+from domain.diff import make_delta, apply_delta
+
+
+class BlobStore:
+    # Compressed blobs named by the SHA-256 of their content, so identical pages are stored once.
+    # Every key (an url) has a bounded history: the newest version is a full blob,
+    # older ones are deltas that rebuild them from the version right after.
+    def __init__(self, root: Path, history: int = 10) -> None:
+        self._root = root
+        self._history = history
+        self._lock = threading.Lock()
+        self._refs: dict[str, int] | None = None
+
+    def get_root(self) -> Path:
+        return self._root
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def blob_path(self, digest: str) -> Path:
+        return self._root.joinpath("objects", digest[:2], digest[2:] + ".z")
+
+    def index_path(self, key: str) -> Path:
+        return self._root.joinpath("history", hashlib.sha256(key.encode()).hexdigest()[:32] + ".json")
+
+    @staticmethod
+    def write_atomic(path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def put(self, data: bytes) -> str:
+        digest = self.digest(data)
+        path = self.blob_path(digest)
+        if not path.exists():
+            self.write_atomic(path, zlib.compress(data, 6))
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        return zlib.decompress(self.blob_path(digest).read_bytes())
+
+    def read_index(self, key: str) -> list[dict]:
+        path = self.index_path(key)
+        if not path.exists():
+            return []
+        return json.loads(path.read_text())
+
+    def write_index(self, key: str, entries: list[dict]):
+        self.write_atomic(self.index_path(key), json.dumps(entries).encode())
+
+    def get_refs(self) -> dict[str, int]:
+        # Built on first use from every index, then kept up to date
+        if self._refs is None:
+            self._refs = {}
+            history = self._root.joinpath("history")
+            if history.exists():
+                for path in history.glob("*.json"):
+                    for digest in self.entry_refs(json.loads(path.read_text())):
+                        self._refs[digest] = self._refs.get(digest, 0) + 1
+        return self._refs
+
+    @staticmethod
+    def entry_refs(entries: list[dict]) -> list[str]:
+        res = [entry["delta"] for entry in entries if entry["delta"] is not None]
+        if entries:
+            res.append(entries[-1]["digest"])
+        return res
+
+    def ref(self, digest: str):
+        refs = self.get_refs()
+        refs[digest] = refs.get(digest, 0) + 1
+
+    def unref(self, digest: str):
+        refs = self.get_refs()
+        count = refs.get(digest, 0) - 1
+        if count > 0:
+            refs[digest] = count
+            return
+        refs.pop(digest, None)
+        self.blob_path(digest).unlink(missing_ok=True)
+
+    def has(self, key: str) -> bool:
+        return self.index_path(key).exists()
+
+    def latest_digest(self, key: str) -> str | None:
+        entries = self.read_index(key)
+        if not entries:
+            return None
+        return entries[-1]["digest"]
+
+    def latest_path(self, key: str) -> Path | None:
+        digest = self.latest_digest(key)
+        if digest is None:
+            return None
+        return self.blob_path(digest)
+
+    def latest(self, key: str) -> str | None:
+        entries = self.read_index(key)
+        if not entries:
+            return None
+        return self.get(entries[-1]["digest"]).decode("utf-8", "surrogatepass")
+
+    def record(self, key: str, content: str, delta: list[list] | None = None, base: str | None = None) -> str:
+        # delta rebuilds the page `base` from content, when it was computed beforehand in the process pool
+        data = content.encode("utf-8", "surrogatepass")
+        with self._lock:
+            entries = self.read_index(key)
+            digest = self.digest(data)
+            if entries and entries[-1]["digest"] == digest:
+                return digest
+
+            self.put(data)
+            self.ref(digest)
+            if entries:
+                # The previous version no longer needs a full copy, only how to get back to it from this one
+                previous = entries[-1]
+                if delta is None or base != previous["digest"]:
+                    previous_text = self.get(previous["digest"]).decode("utf-8", "surrogatepass")
+                    delta = make_delta(content.splitlines(keepends=True), previous_text.splitlines(keepends=True))
+                previous["delta"] = self.put(json.dumps(delta).encode())
+                self.ref(previous["delta"])
+                self.unref(previous["digest"])
+
+            entries.append({"time": datetime.utcnow().isoformat(), "digest": digest, "delta": None})
+            while len(entries) > self._history:
+                oldest = entries.pop(0)
+                self.unref(oldest["delta"])
+            self.write_index(key, entries)
+            return digest
+
+    def versions(self, key: str) -> list[tuple[datetime, str]]:
+        return [(datetime.fromisoformat(entry["time"]), entry["digest"]) for entry in self.read_index(key)]
+
+    def version(self, key: str, index: int) -> str | None:
+        # index counts back from the newest version: 0 is the current page
+        entries = self.read_index(key)
+        if index >= len(entries):
+            return None
+        lines = self.get(entries[-1]["digest"]).decode("utf-8", "surrogatepass").splitlines(keepends=True)
+        for entry in reversed(entries[len(entries) - 1 - index:-1]):
+            lines = apply_delta(lines, json.loads(self.get(entry["delta"])))
+        return "".join(lines)
+
+    def forget(self, key: str):
+        with self._lock:
+            entries = self.read_index(key)
+            for digest in self.entry_refs(entries):
+                self.unref(digest)
+            self.index_path(key).unlink(missing_ok=True)
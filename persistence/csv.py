@@ -1,10 +1,14 @@
+from collections.abc import Collection
 from pathlib import Path
-from domain.classes import Base, Server, User, Website, Monitor, Channel
+from domain.classes import Base, Server, User, Website, Monitor, Channel, CHANGES
+from persistence.interface import DomainLoader, DomainSaver
 import domain.classes
 import _csv
+import io
+import os
 
 
-class CSVDomainLoader:
+class CSVDomainLoader(DomainLoader):
     @staticmethod
     def load(folder: Path) -> Base:
         data: dict[str, list[str]] = {
@@ -15,7 +19,7 @@ class CSVDomainLoader:
             "users_websites.csv": [],
         }
 
-        monitor_data: dict[str, dict[str, str]] = {}
+        monitor_data: dict[str, dict[str, list[str]]] = {}
 
         for file, content in data.items():
             with folder.joinpath(file).open("r") as f:
@@ -24,16 +28,17 @@ class CSVDomainLoader:
         for file in folder.joinpath("monitors").iterdir():
             with file.open("r") as f:
                 reader = _csv.reader(f)
-                monitor_data = {
-                    file.name.removesuffix(".csv"): {
-                        row[0]: row for row in reader
-                    }
+                monitor_data[file.name.removesuffix(".csv")] = {
+                    row[0]: row for row in reader
                 }
 
         res = CSVDomainLoader.load_servers(data)
         res = list(res.values())
-        CSVDomainLoader.load_monitors(res, monitor_data)
-        return Base(res)
+        CSVDomainLoader.load_monitors(monitor_data)
+        base = Base(res)
+        # Everything that was just loaded is already on disk
+        CHANGES.clear()
+        return base
 
     @staticmethod
     def load_servers(data: dict[str, list[str]]) -> dict[int, Server]:
@@ -53,7 +58,7 @@ class CSVDomainLoader:
     ) -> dict[int, Channel]:
         channels: dict[int, Channel] = {}
         for line in data["channels.csv"]:
-            chid, servid = line.split(",")
+            chid, servid = next(_csv.reader([line]))
             chid = int(chid)
             servid = int(servid)
             channels[chid] = Channel(chid, servers[servid])
@@ -63,44 +68,74 @@ class CSVDomainLoader:
 
     @staticmethod
     def load_websites(channels: dict[int, Channel], data: dict[str, list[str]]):
-        websites: dict[str, Website] = {}
+        websites: dict[tuple[int, str], Website] = {}
+        websites_by_url: dict[str, Website] = {}
         for line in data["websites.csv"]:
-            url, name, chid, monitor_class = line.split(",")
+            # The normalizer column was added later
+            url, name, chid, monitor_class, *normalizer = next(_csv.reader([line]))
             chid = int(chid)
-            websites[url] = Website(
-                name, url, channels[chid], getattr(domain.classes, monitor_class)
+            website = Website(
+                name, url, channels[chid], getattr(domain.classes, monitor_class), *normalizer
             )
-        CSVDomainLoader.load_users(websites, data)
+            websites[website.get_key()] = website
+            websites_by_url.setdefault(url, website)
+        CSVDomainLoader.load_users(websites, websites_by_url, data)
 
     @staticmethod
-    def load_users(websites: dict[str, Website], data: dict[str, list[str]]):
-        users: dict[int, User] = {}
-        for line in data["users.csv"]:
-            id = int(line)
-            users[id] = User(id)
-
+    def load_users(
+            websites: dict[tuple[int, str], Website], websites_by_url: dict[str, Website], data: dict[str, list[str]]
+    ):
         for line in data["users_websites.csv"]:
-            usid, weburl = line.split(",")
+            usid, *website_key = next(_csv.reader([line]))
             usid = int(usid)
-            users[usid].add_website(websites[weburl])
+            if len(website_key) == 1:
+                # Rows written before subscriptions were keyed by guild only name the url
+                website = websites_by_url.get(website_key[0])
+            else:
+                website = websites.get((int(website_key[0]), website_key[1]))
+            if website is None:
+                continue
+            # One user per guild, like the SQLite loader, so subscriptions never move to another guild
+            user = website.get_channel().get_server().get_user(usid)
+            if user is None:
+                user = User(usid)
+            user.add_website(website)
 
     @staticmethod
-    def load_monitors(servers: list[Server], monitor_data: dict[str, dict[str, str]]):
-        websites: list[Website] = []
+    def load_monitors(monitor_data: dict[str, dict[str, list[str]]]):
+        for monitor in Monitor.get_monitors():
+            monitor_class = monitor.__class__.__name__
+            row = monitor_data.get(monitor_class, {}).get(monitor.get_key())
+            if row is not None:
+                monitor.set_data(row)
 
-        for server in servers:
-            for channel in server.get_channels():
-                websites.extend(channel.get_websites())
 
-        for website in websites:
-            monitor = website.get_monitor()
-            monitor_class = monitor.__class__.__name__
-            monitor.set_data(monitor_data[monitor_class][website.get_url()])
+class CSVDomainSaver(DomainSaver):
+    @staticmethod
+    def write(data: dict[str, list[str]], folder: Path):
+        folder.joinpath("monitors").mkdir(exist_ok=True)
+        for filename, lines in data.items():
+            CSVDomainSaver.write_atomic(folder.joinpath(filename), lines)
 
+    @staticmethod
+    def write_atomic(path: Path, lines: list[str]):
+        # Write a sibling file and rename it over the old one, so a crash never leaves a truncated table
+        tmp = path.with_name(path.name + ".tmp")
+        with tmp.open("w") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
 
-class CSVDomainSaver:
     @staticmethod
-    def save(base: Base, folder: Path):
+    def row(*values: object) -> str:
+        # Strings are always quoted, names are free text and the lines are stripped when they are read
+        buffer = io.StringIO()
+        _csv.writer(buffer, quoting=_csv.QUOTE_NONNUMERIC, lineterminator="\n").writerow(values)
+        return buffer.getvalue()
+
+    @staticmethod
+    def serialize(base: Base, dirty: dict[str, set[object]] | None = None) -> dict[str, list[str]]:
         data: dict[str, list[str]] = {
             "servers.csv": [],
             "channels.csv": [],
@@ -111,21 +146,18 @@ class CSVDomainSaver:
 
         servers = base.get_servers()
         CSVDomainSaver.save_servers(servers, data)
-        folder.joinpath("monitors").mkdir(exist_ok=True)
-
-        for filename, lines in data.items():
-            with folder.joinpath(filename).open("w") as f:
-                f.writelines(lines)
+        if dirty is None:
+            return data
+        # CSV tables can only be rewritten whole, but untouched ones are left alone
+        return {f"{table}.csv": data.get(f"{table}.csv", []) for table in dirty}
 
     @staticmethod
-    def save_servers(servers: list[Server], data: dict[str, list[str]]):
+    def save_servers(servers: Collection[Server], data: dict[str, list[str]]):
         channels: list[Channel] = []
         data["servers.csv"].append(f"server id\n")
         for server in servers:
             channels.extend(server.get_channels())
-            data["servers.csv"].append(
-                f"{server.get_id()}\n"
-            )
+            data["servers.csv"].append(CSVDomainSaver.row(server.get_id()))
 
         CSVDomainSaver.save_channels(channels, data)
 
@@ -135,27 +167,30 @@ class CSVDomainSaver:
         data["channels.csv"].append(f"channel id, server id\n")
         for channel in channels:
             websites.extend(channel.get_websites())
-            data["channels.csv"].append(
-                f"{channel.get_id()},{channel.get_server().get_id()}\n"
-            )
+            data["channels.csv"].append(CSVDomainSaver.row(channel.get_id(), channel.get_server().get_id()))
 
         CSVDomainSaver.save_websites(websites, data)
 
     @staticmethod
     def save_websites(websites: list[Website], data: dict[str, list[str]]):
         users: set[User] = set()
-        monitors: list[Monitor] = []
+        monitors: dict[int, Monitor] = {}
         data["websites.csv"].append(
-            f"website url, website name, channel id, monitor class\n"
+            f"website url, website name, channel id, monitor class, normalizer\n"
         )
         for website in websites:
             users.update(website.get_users())
-            monitors.append(website.get_monitor())
-            data["websites.csv"].append(
-                f"{website.get_url()},{website.get_name()},{website.get_channel().get_id()},{website.get_monitor().__class__.__name__}\n"
-            )
-
-        for monitor in monitors:
+            monitor = website.get_monitor()
+            monitors[id(monitor)] = monitor
+            data["websites.csv"].append(CSVDomainSaver.row(
+                website.get_url(),
+                website.get_name(),
+                website.get_channel().get_id(),
+                website.get_monitor().__class__.__name__,
+                website.get_normalizer(),
+            ))
+
+        for monitor in monitors.values():
             filename = f"monitors/{monitor.__class__.__name__}.csv"
             if filename not in data:
                 data[filename] = []
@@ -166,11 +201,10 @@ class CSVDomainSaver:
     @staticmethod
     def save_users(users: set[User], data: dict[str, list[str]]):
         data["users.csv"].append(f"user id\n")
-        for user in users:
-            data["users.csv"].append(f"{user.get_id()}\n")
-        data["users_websites.csv"].append(f"user id, website url\n")
+        # A user subscribed in several guilds is one User per guild
+        for id in {user.get_id() for user in users}:
+            data["users.csv"].append(CSVDomainSaver.row(id))
+        data["users_websites.csv"].append(f"user id, server id, website name\n")
         for user in users:
             for website in user.get_websites():
-                data["users_websites.csv"].append(
-                    f"{user.get_id()},{website.get_url()}\n"
-                )
+                data["users_websites.csv"].append(CSVDomainSaver.row(user.get_id(), *website.get_key()))
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+from domain.classes import Base, CHANGES
+from engine.metrics import METRICS
+from persistence.interface import DomainSaver
+
+
+class DebouncedSaver:
+    def __init__(self, base: Base, location: Path, saver: type[DomainSaver], delay: float = 2) -> None:
+        self._base = base
+        self._location = location
+        self._saver = saver
+        self._delay = delay
+        self._pending: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    def request(self):
+        # Bursts of requests within the delay end up in a single flush
+        if self._pending is None or self._pending.done():
+            self._pending = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self._delay)
+        # Shielded so that close() can cancel the wait without interrupting a write
+        await asyncio.shield(self.flush())
+
+    async def flush(self):
+        async with self._lock:
+            dirty = CHANGES.pop()
+            if not dirty:
+                return
+            # Snapshot on the event loop, where the domain is mutated, and only write in the worker thread
+            snapshot = self._saver.serialize(self._base, dirty)
+            try:
+                with METRICS.timer("save_seconds"):
+                    await asyncio.to_thread(self._saver.write, snapshot, self._location)
+            except Exception:
+                CHANGES.merge(dirty)
+                raise
+
+    async def close(self):
+        if self._pending is not None and not self._pending.done():
+            self._pending.cancel()
+        await self.flush()
@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any
+from domain.classes import Base
+
+
+class DomainLoader(ABC):
+    @staticmethod
+    @abstractmethod
+    def load(location: Path) -> Base:
+        pass
+
+
+class DomainSaver(ABC):
+    @staticmethod
+    @abstractmethod
+    def serialize(base: Base, dirty: dict[str, set[object]] | None = None) -> Any:
+        # Runs on the event loop: copy whatever write needs out of the domain
+        pass
+
+    @staticmethod
+    @abstractmethod
+    def write(snapshot: Any, location: Path):
+        # May run in a worker thread: must only use the snapshot
+        pass
+
+    @classmethod
+    def save(cls, base: Base, location: Path, dirty: dict[str, set[object]] | None = None):
+        cls.write(cls.serialize(base, dirty), location)
@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+from pathlib import Path
+from domain.classes import Base, Server, User, Website, Monitor, Channel, CHANGES
+from persistence.interface import DomainLoader, DomainSaver
+from persistence.csv import CSVDomainLoader
+import domain.classes
+import _csv
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS servers (
+    id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS channels (
+    id INTEGER PRIMARY KEY,
+    server_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS channels_server ON channels (server_id);
+CREATE TABLE IF NOT EXISTS websites (
+    server_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    url TEXT NOT NULL,
+    channel_id INTEGER NOT NULL,
+    monitor_class TEXT NOT NULL,
+    normalizer TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (server_id, name)
+);
+CREATE INDEX IF NOT EXISTS websites_url ON websites (url);
+CREATE INDEX IF NOT EXISTS websites_channel ON websites (channel_id);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS subscriptions (
+    user_id INTEGER NOT NULL,
+    server_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (user_id, server_id, name)
+);
+CREATE INDEX IF NOT EXISTS subscriptions_website ON subscriptions (server_id, name);
+-- url is the key of the monitor, the url followed by the normalizer spec if it has one
+CREATE TABLE IF NOT EXISTS monitors (
+    monitor_class TEXT NOT NULL,
+    url TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (monitor_class, url)
+);
+"""
+
+# Primary key columns of every table, used to delete rows
+KEYS: dict[str, tuple[str, ...]] = {
+    "servers": ("id",),
+    "channels": ("id",),
+    "websites": ("server_id", "name"),
+    "users": ("id",),
+    "subscriptions": ("user_id", "server_id", "name"),
+    "monitors": ("monitor_class", "url"),
+}
+
+COLUMNS: dict[str, tuple[str, ...]] = {
+    "servers": ("id",),
+    "channels": ("id", "server_id"),
+    "websites": ("server_id", "name", "url", "channel_id", "monitor_class", "normalizer"),
+    "users": ("id",),
+    "subscriptions": ("user_id", "server_id", "name"),
+    "monitors": ("monitor_class", "url", "data"),
+}
+
+
+def connect(path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    # Columns added after the table was first created
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(websites)")}
+    if "normalizer" not in columns:
+        conn.execute("ALTER TABLE websites ADD COLUMN normalizer TEXT NOT NULL DEFAULT ''")
+    return conn
+
+
+class SQLiteSnapshot:
+    def __init__(self, full: bool) -> None:
+        # A full snapshot replaces the content of every table
+        self.full = full
+        self.upserts: dict[str, list[tuple]] = {table: [] for table in COLUMNS}
+        self.deletes: dict[str, list[tuple]] = {table: [] for table in COLUMNS}
+
+
+class SQLiteDomainLoader(DomainLoader):
+    @staticmethod
+    def load(path: Path) -> Base:
+        conn = connect(path)
+        try:
+            servers: dict[int, Server] = {}
+            for (id,) in conn.execute("SELECT id FROM servers"):
+                servers[id] = Server(id)
+
+            channels: dict[int, Channel] = {}
+            for id, server_id in conn.execute("SELECT id, server_id FROM channels"):
+                channels[id] = Channel(id, servers[server_id])
+
+            websites: dict[tuple[int, str], Website] = {}
+            for server_id, name, url, channel_id, monitor_class, normalizer in conn.execute(
+                    "SELECT server_id, name, url, channel_id, monitor_class, normalizer FROM websites"
+            ):
+                websites[(server_id, name)] = Website(
+                    name, url, channels[channel_id], getattr(domain.classes, monitor_class), normalizer
+                )
+
+            for user_id, server_id, name in conn.execute("SELECT user_id, server_id, name FROM subscriptions"):
+                website = websites.get((server_id, name))
+                if website is None:
+                    continue
+                user = servers[server_id].get_user(user_id)
+                if user is None:
+                    user = User(user_id)
+                user.add_website(website)
+
+            for monitor_class, key, data in conn.execute("SELECT monitor_class, url, data FROM monitors"):
+                monitor = Monitor.find(getattr(domain.classes, monitor_class), key)
+                if monitor is not None:
+                    monitor.set_data(next(_csv.reader([data])))
+        finally:
+            conn.close()
+
+        base = Base(list(servers.values()))
+        CHANGES.clear()
+        return base
+
+    @staticmethod
+    def migrate(folder: Path, path: Path) -> Base:
+        # One-shot import of an existing CSV data folder
+        base = CSVDomainLoader.load(folder)
+        SQLiteDomainSaver.save(base, path)
+        return base
+
+
+class SQLiteDomainSaver(DomainSaver):
+    @staticmethod
+    def serialize(base: Base, dirty: dict[str, set[object]] | None = None) -> SQLiteSnapshot:
+        if dirty is None:
+            return SQLiteDomainSaver.serialize_all(base)
+
+        snapshot = SQLiteSnapshot(full=False)
+        for table, keys in dirty.items():
+            for key in keys:
+                SQLiteDomainSaver.serialize_row(base, snapshot, table, key)
+        return snapshot
+
+    @staticmethod
+    def serialize_all(base: Base) -> SQLiteSnapshot:
+        snapshot = SQLiteSnapshot(full=True)
+        users: set[int] = set()
+        for server in base.get_servers():
+            snapshot.upserts["servers"].append((server.get_id(),))
+            for channel in server.get_channels():
+                snapshot.upserts["channels"].append((channel.get_id(), server.get_id()))
+                for website in channel.get_websites():
+                    snapshot.upserts["websites"].append(SQLiteDomainSaver.website_row(website))
+                    for user in website.get_users():
+                        users.add(user.get_id())
+                        snapshot.upserts["subscriptions"].append((user.get_id(), *website.get_key()))
+        snapshot.upserts["users"] = [(id,) for id in users]
+        for monitor in Monitor.get_monitors():
+            snapshot.upserts["monitors"].append(SQLiteDomainSaver.monitor_row(monitor))
+        return snapshot
+
+    @staticmethod
+    def serialize_row(base: Base, snapshot: SQLiteSnapshot, table: str, key: object):
+        row: tuple | None = None
+
+        if table == "servers":
+            if base.get_server(key) is not None:
+                row = (key,)
+        elif table == "channels":
+            channel = base.get_channel(key)
+            if channel is not None:
+                row = (key, channel.get_server().get_id())
+        elif table == "websites":
+            website = base.get_website(*key)
+            if website is not None:
+                row = SQLiteDomainSaver.website_row(website)
+        elif table == "users":
+            if base.has_subscriptions(key):
+                row = (key,)
+        elif table == "users_websites":
+            table = "subscriptions"
+            user_id, server_id, name = key
+            if base.is_subscribed(user_id, server_id, name):
+                row = key
+        elif table.startswith("monitors/"):
+            monitor_class = table.removeprefix("monitors/")
+            table = "monitors"
+            monitor = Monitor.find(getattr(domain.classes, monitor_class), key)
+            if monitor is not None:
+                row = SQLiteDomainSaver.monitor_row(monitor)
+            key = (monitor_class, key)
+        else:
+            return
+
+        if row is not None:
+            snapshot.upserts[table].append(row)
+        else:
+            snapshot.deletes[table].append(key if isinstance(key, tuple) else (key,))
+
+    @staticmethod
+    def website_row(website: Website) -> tuple:
+        return (
+            *website.get_key(),
+            website.get_url(),
+            website.get_channel().get_id(),
+            website.get_monitor().__class__.__name__,
+            website.get_normalizer(),
+        )
+
+    @staticmethod
+    def monitor_row(monitor: Monitor) -> tuple:
+        return monitor.__class__.__name__, monitor.get_key(), monitor.get_data()
+
+    @staticmethod
+    def write(snapshot: SQLiteSnapshot, path: Path):
+        conn = connect(path)
+        try:
+            with conn:
+                for table, columns in COLUMNS.items():
+                    if snapshot.full:
+                        conn.execute(f"DELETE FROM {table}")
+                    keys = KEYS[table]
+                    if snapshot.deletes[table]:
+                        condition = " AND ".join(f"{column} = ?" for column in keys)
+                        conn.executemany(f"DELETE FROM {table} WHERE {condition}", snapshot.deletes[table])
+                    if snapshot.upserts[table]:
+                        placeholders = ", ".join("?" for _ in columns)
+                        updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column not in keys)
+                        conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+                        conn.executemany(
+                            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) "
+                            f"ON CONFLICT ({', '.join(keys)}) {conflict}",
+                            snapshot.upserts[table],
+                        )
+        finally:
+            conn.close()
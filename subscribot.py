@@ -1,66 +1,223 @@
 from pathlib import Path
+import asyncio
 import discord
-from discord.ext import tasks
+from aiohttp import web
 from discord import app_commands
-from domain.classes import Base, Channel, ETagMonitor, Server, Website, User
+from domain.classes import Base, Channel, ETagMonitor, IndexedMonitor, Monitor, PushMonitor, Server, Website, User
 from persistence.csv import CSVDomainLoader, CSVDomainSaver
+from persistence.sqlite import SQLiteDomainLoader, SQLiteDomainSaver
+from persistence.debounce import DebouncedSaver
+from persistence.blobs import BlobStore
+from network.fetcher import AsyncFetcher
+from engine.scheduler import PollScheduler
+from engine.processing import UpdateProcessor
+from engine.notifier import NotificationDispatcher
+from engine.metrics import METRICS
+from engine.sharding import ShardedPoller
+from engine.push import PushReceiver
+from engine.fairness import FairQueue
+from engine.polling import check_batch
+from domain.normalize import get_normalizer, make_spec
 import os
 
 DATA_FOLDER: Path = Path("data")
-BASE: Base = CSVDomainLoader.load(DATA_FOLDER)
+DATABASE: Path = DATA_FOLDER.joinpath("uscitibot.sqlite3")
+PAGE_MONITORS: tuple[type[ETagMonitor], ...] = (ETagMonitor, PushMonitor, IndexedMonitor)
+for page_monitor in PAGE_MONITORS:
+    page_monitor.store = BlobStore(page_monitor.data_dir, history=int(os.environ.get("PAGE_HISTORY", "10")))
+ETagMonitor.diff_budget = int(os.environ.get("DIFF_BUDGET", "6000"))
+ETagMonitor.head_probe_size = int(os.environ.get("HEAD_PROBE_SIZE", "0"))
+
+
+def load_domain() -> tuple[Base, DebouncedSaver]:
+    delay = float(os.environ.get("SAVE_DELAY", "2"))
+    if os.environ.get("STORAGE", "csv") == "sqlite":
+        if not DATABASE.exists() and DATA_FOLDER.joinpath("servers.csv").exists():
+            base = SQLiteDomainLoader.migrate(DATA_FOLDER, DATABASE)
+        else:
+            base = SQLiteDomainLoader.load(DATABASE)
+        return base, DebouncedSaver(base, DATABASE, SQLiteDomainSaver, delay=delay)
+
+    base = CSVDomainLoader.load(DATA_FOLDER)
+    return base, DebouncedSaver(base, DATA_FOLDER, CSVDomainSaver, delay=delay)
+
+
+# Loaded in setup_hook, no website is fetched before the bot is online
+BASE: Base = Base()
+SAVER: DebouncedSaver | None = None
+FETCH_OPTIONS: dict[str, float] = {
+    "concurrency": int(os.environ.get("FETCH_CONCURRENCY", "20")),
+    "host_concurrency": int(os.environ.get("HOST_CONCURRENCY", "2")),
+    "host_spacing": float(os.environ.get("HOST_SPACING", "0.5")),
+    "max_body_size": int(os.environ.get("MAX_BODY_SIZE", str(5 * 1024 * 1024))),
+}
+SCHEDULE_OPTIONS: dict[str, float] = {
+    "min_interval": float(os.environ.get("POLL_MIN_INTERVAL", "60")),
+    "max_interval": float(os.environ.get("POLL_MAX_INTERVAL", "21600")),
+}
+FAIR_OPTIONS: dict[str, object] = {
+    "concurrency": FETCH_OPTIONS["concurrency"],
+    "guild_concurrency": int(os.environ.get("GUILD_CONCURRENCY", "0")),
+    "budget": float(os.environ.get("GUILD_BUDGET", "0")),
+    "latency_target": float(os.environ.get("GUILD_LATENCY_TARGET", "30")),
+    # "<guild id>:<weight>,...", guilds not listed weigh 1
+    "weights": {
+        int(guild): float(weight)
+        for guild, _, weight in (item.partition(":") for item in os.environ.get("GUILD_WEIGHTS", "").split(",") if item)
+    },
+}
+SHARDS: int = int(os.environ.get("SHARDS", "0"))
+# A sitemap or feed is read at most once per shortest interval, by all the pages it lists
+IndexedMonitor.index_max_age = SCHEDULE_OPTIONS["min_interval"]
+FETCHER: AsyncFetcher = AsyncFetcher(**FETCH_OPTIONS)
+PROCESSOR: UpdateProcessor = UpdateProcessor(
+    workers=int(os.environ.get("PROCESS_WORKERS", "2")),
+    inline_limit=int(os.environ.get("PROCESS_INLINE_LIMIT", "65536")),
+)
+# Due checks wait for the turn of their guilds here, so a guild with many websites can't hold back the others
+FAIR: FairQueue = FairQueue(**FAIR_OPTIONS)
+# Replaced by a ShardedPoller in setup_hook when SHARDS is set, the workers re-import this module
+SCHEDULER: PollScheduler | ShardedPoller = PollScheduler(**SCHEDULE_OPTIONS)
+
+
+async def send_message(channel_id: int, content: str):
+    channel = client.get_channel(channel_id) or await client.fetch_channel(channel_id)
+    await channel.send(content)  # type: ignore
+
+
+NOTIFIER: NotificationDispatcher = NotificationDispatcher(
+    send_message,
+    window=float(os.environ.get("NOTIFY_WINDOW", "2")),
+)
+METRICS.set_gauge("notification_queue", NOTIFIER.get_pending_count)
+METRICS.set_gauge("monitors_scheduled", lambda: SCHEDULER.get_scheduled_count())
+METRICS.set_gauge("open_circuits", FETCHER.get_open_circuit_count)
+METRICS.set_gauge("checks_waiting", FAIR.get_waiting_count)
+METRICS_PORT: int = int(os.environ.get("METRICS_PORT", "0"))
+
+
+def poke(monitor: PushMonitor):
+    SCHEDULER.poke(monitor)
+
+
+def lease_changed(monitor: PushMonitor):
+    # Sharded monitors are checked with the state the worker has
+    SCHEDULER.update(monitor)
+    SAVER.request()
+
+
+# Hubs and webhooks have to reach the listener at PUSH_URL, push monitors are only polled without it
+PUSH_URL: str = os.environ.get("PUSH_URL", "")
+PUSH_PORT: int = int(os.environ.get("PUSH_PORT", "8080"))
+PUSH: PushReceiver | None = PushReceiver(PUSH_URL, FETCHER, poke, lease_changed) if PUSH_URL else None
+if PUSH is not None:
+    METRICS.set_gauge("push_subscriptions", PUSH.get_active_count)
 
 
 class MyClient(discord.Client):
     def __init__(self, *, intents: discord.Intents):
         super().__init__(intents=intents)
         self.tree = app_commands.CommandTree(self)
+        self.poller: asyncio.Task | None = None
+        self.checks: set[asyncio.Task] = set()
+        self.metrics: web.AppRunner | None = None
 
     async def setup_hook(self):
+        global BASE, SAVER, SCHEDULER
+        BASE, SAVER = await asyncio.to_thread(load_domain)
+        if SHARDS:
+            SCHEDULER = ShardedPoller(SHARDS, {
+                "stores": {monitor.__name__: str(monitor.store.get_root()) for monitor in PAGE_MONITORS},
+                "index_max_age": IndexedMonitor.index_max_age,
+                "diff_budget": ETagMonitor.diff_budget,
+                "head_probe_size": ETagMonitor.head_probe_size,
+                "fetcher": FETCH_OPTIONS,
+                "scheduler": SCHEDULE_OPTIONS,
+                "fair": FAIR_OPTIONS,
+            })
+        if METRICS_PORT:
+            # Local only, put a reverse proxy in front of it to scrape it from elsewhere
+            self.metrics = await METRICS.serve("127.0.0.1", METRICS_PORT)
+        if PUSH is not None:
+            # On every interface, the hubs are elsewhere and the pushes are authenticated by their signature
+            await PUSH.start("0.0.0.0", PUSH_PORT)
         await self.tree.sync()
 
     async def on_ready(self):
         await update_counter(self)
-        if not check_updates.is_running():
-            check_updates.start(self)
-        else:
-            check_updates.restart(self)
+        if self.poller is None or self.poller.done():
+            # Monitors without a stored page are due immediately, the rest are spread over their interval
+            for monitor in Monitor.get_monitors():
+                SCHEDULER.add(monitor)
+            if isinstance(SCHEDULER, ShardedPoller):
+                self.poller = asyncio.create_task(receive_updates(self))
+            else:
+                self.poller = asyncio.create_task(poll_websites(self))
         print("Ready to go\n")
 
+    async def close(self):
+        if isinstance(SCHEDULER, ShardedPoller):
+            await SCHEDULER.close()
+        await NOTIFIER.close()
+        if PUSH is not None:
+            await PUSH.close()
+        await FETCHER.close()
+        PROCESSOR.close()
+        if SAVER is not None:
+            await SAVER.close()
+        if self.metrics is not None:
+            await self.metrics.cleanup()
+        await super().close()
+
 
 intents = discord.Intents.default()
 client = MyClient(intents=intents)
 
 
 async def update_counter(bot: MyClient):
-    count = 0
-    for server in BASE.get_servers():
-        for channel in server.get_channels():
-            count += len(channel.get_websites())
-
+    count = BASE.get_website_count()
     activity = discord.Game(f"I'm monitoring {count} websites!")
     await bot.change_presence(activity=activity)
 
 
-@tasks.loop(minutes=5)
-async def check_updates(bot: MyClient):
-    for server in BASE.get_servers():
-        for channel in server.get_channels():
-            for website in channel.get_websites():
-                monitor = website.get_monitor()
-                monitor.check_update()
-                update= monitor.is_updated()
-                if update:
-                    output: str = f"{website.get_hyperlink()} was updated!\n"
-                    for user in website.get_users():
-                        output += f"* <@{user.get_id()}>\n"
-                    output += "\n```html\n"
-                    output += update
-                    output += "```"
-                    if len(output) > 2000:
-                        addition = "...```\nThe message was truncated because it was too long :("
-                        output = output[:2000-len(addition)] + addition
-                    await bot.get_channel(website.get_channel().get_id()).send(output)  # type: ignore
-    CSVDomainSaver.save(BASE, DATA_FOLDER)
+async def poll_websites(bot: MyClient):
+    while True:
+        monitors = await SCHEDULER.next_due()
+        if monitors:
+            task = asyncio.create_task(check_updates(bot, monitors))
+            bot.checks.add(task)
+            task.add_done_callback(bot.checks.discard)
+
+
+async def check_updates(bot: MyClient, monitors: list[Monitor]):
+    results = await check_batch(monitors, FETCHER, PROCESSOR, SCHEDULER, FAIR, Monitor.get_server_ids)
+    for monitor, result in zip(monitors, results):
+        if result and not isinstance(result, Exception):
+            notify_update(monitor, result)
+    SAVER.request()
+
+
+async def receive_updates(bot: MyClient):
+    # The shards check the monitors, the bot keeps their state, the pages and the notifications
+    async for monitor, data, update, content in SCHEDULER.events():
+        monitor.set_data(data)
+        monitor.mark_dirty()
+        if content is not None:
+            await asyncio.to_thread(monitor.save_content, *content)
+        # Only clears the flag restored by set_data, the diff comes with the event
+        monitor.is_updated()
+        if update:
+            notify_update(monitor, update)
+        SAVER.request()
+
+
+def notify_update(monitor: Monitor, update: str):
+    # Queued, sending is up to the notifier so the next checks don't wait on Discord
+    for website in monitor.get_websites():
+        output: str = f"{website.get_hyperlink()} was updated!\n"
+        for user in website.get_users():
+            output += f"* <@{user.get_id()}>\n"
+        NOTIFIER.notify(website.get_channel().get_id(), output, update)
 
 
 @client.tree.command(
@@ -72,10 +229,21 @@ async def check_updates(bot: MyClient):
     name="The name of this subscription",
     website="The full URL of the website that you want to monitor for changes",
     channel="The discord channel where the updates should be sent",
+    clean="Ignore scripts, styles, comments and whitespace changes",
+    selector="Only watch the elements matching this selector, e.g. div#news, .events",
+    push="Check the website as soon as its WebSub hub or a signed webhook says it changed",
+    index="A sitemap or feed listing the page, the page is only fetched when its date in there changes",
 )
 @discord.app_commands.checks.has_permissions(manage_messages=True)
 async def monitor_website(
-    interaction: discord.Interaction, name: str, website: str, channel: str
+    interaction: discord.Interaction,
+    name: str,
+    website: str,
+    channel: str,
+    clean: bool = False,
+    selector: str | None = None,
+    push: bool = False,
+    index: str | None = None,
 ):
     # If this is not a discord server (like a DM)
     if interaction.guild_id is None:
@@ -96,16 +264,54 @@ async def monitor_website(
         await interaction.response.send_message(f"Please use the #<channel> format")
         return
 
+    if guild.get_website(name) is not None:
+        await interaction.response.send_message(f"{name} is already being monitored")
+        return
+
+    spec = make_spec(clean, selector)
+    try:
+        get_normalizer(spec)
+    except ValueError as e:
+        await interaction.response.send_message(f"{e}, use tags, #ids and .classes separated by commas")
+        return
+
+    if push and PUSH is None:
+        await interaction.response.send_message(f"Push updates are not enabled on this bot")
+        return
+
+    if push and index:
+        await interaction.response.send_message(f"Please choose either push or index")
+        return
+
+    monitor_class: type[Monitor] = ETagMonitor
+    if push:
+        monitor_class = PushMonitor
+    elif index:
+        monitor_class = IndexedMonitor
+
     chan = guild.get_channel(chanid)
     if chan is None:
         chan = Channel(chanid, guild)
 
-    webs = Website(name, website, chan, ETagMonitor)
-    webs.get_monitor().check_update()
-    CSVDomainSaver.save(BASE, DATA_FOLDER)
+    webs = Website(name, website, chan, monitor_class, spec)
+    if isinstance(webs.get_monitor(), IndexedMonitor):
+        # Websites sharing the monitor share its index too, the last one given wins
+        webs.get_monitor().set_index(index)
+    # The baseline is fetched by the poller, so the interaction is answered right away
+    SCHEDULER.add(webs.get_monitor())
+    SAVER.request()
     await interaction.response.send_message(
         f"{webs.get_hyperlink()} is now being monitored.\nUpdates will be posted in {chan.get_hyperlink()}"
     )
+    monitor = webs.get_monitor()
+    if isinstance(monitor, PushMonitor):
+        # Only shown to whoever added the website, anyone with the secret can trigger checks
+        await interaction.followup.send(
+            f"Websites with a WebSub hub are subscribed to automatically. Webhooks can POST to "
+            f"{PUSH.get_callback(monitor)} with an `X-Hub-Signature-256: sha256=<HMAC of the body>` header "
+            f"signed with the secret `{monitor.get_secret()}`",
+            ephemeral=True,
+        )
 
     await update_counter(client)
 
@@ -129,7 +335,12 @@ async def unmonitor_website(interaction: discord.Interaction, name: str):
 
     webs = guild.remove_website(name)
     if webs:
-        CSVDomainSaver.save(BASE, DATA_FOLDER)
+        if not webs.get_monitor().get_websites():
+            SCHEDULER.remove(webs.get_monitor())
+        else:
+            # The guilds of the monitor may have changed, sharded monitors take their turns by them
+            SCHEDULER.update(webs.get_monitor())
+        SAVER.request()
         await interaction.response.send_message(
             f"{webs.get_hyperlink()} is not being monitored anymore"
         )
@@ -158,9 +369,10 @@ async def list_websites(interaction: discord.Interaction):
     if len(monitorati) > 0:
         output = ""
         for web in monitorati:
-            output += (
-                f"* {web.get_hyperlink()} in {web.get_channel().get_hyperlink()}\n"
-            )
+            output += f"* {web.get_hyperlink()} in {web.get_channel().get_hyperlink()}"
+            if web.get_normalizer():
+                output += f" (`{web.get_normalizer()}`)"
+            output += "\n"
     else:
         output = "No websites are being monitored"
     await interaction.response.send_message(output)
@@ -201,7 +413,7 @@ async def subscribe(interaction: discord.Interaction, name: str):
         f"{user.get_hyperlink()} is now subscribed to {website.get_hyperlink()}"
     )
 
-    CSVDomainSaver.save(BASE, DATA_FOLDER)
+    SAVER.request()
 
 
 @client.tree.command(
@@ -241,7 +453,7 @@ async def unsubscribe(interaction: discord.Interaction, name: str):
         f"{user.get_hyperlink()} is now unsubscribed from {website.get_hyperlink()}"
     )
 
-    CSVDomainSaver.save(BASE, DATA_FOLDER)
+    SAVER.request()
 
 
 @client.tree.command(
@@ -279,6 +491,63 @@ async def list_subscriptions(interaction: discord.Interaction):
     await interaction.response.send_message(output)
 
 
-tkn = os.environ.get("DISCORD_TOKEN")
+def format_stats() -> str:
+    statuses = METRICS.get_counters("fetch_responses_total")
+    total = sum(statuses.values())
+    by_status = ", ".join(f"{dict(labels)['status']}: {count:.0f}" for labels, count in sorted(statuses.items()))
+    received = sum(METRICS.get_counters("fetch_bytes_total").values())
+    cycles = METRICS.get_histogram("cycle_seconds")
+    lag = METRICS.get_histogram("poll_lag_seconds")
+
+    output = f"**Fetches:** {total:.0f} ({by_status or 'none yet'}), {received / 2 ** 20:.1f} MiB\n"
+    output += (
+        f"**Cycles:** {cycles.get_count()}, mean {cycles.get_mean():.2f}s, p95 under {cycles.quantile(0.95)}s "
+        f"(minimum interval {SCHEDULER.get_min_interval():.0f}s)\n"
+    )
+    output += f"**Lag:** p95 under {lag.quantile(0.95)}s\n"
+    output += (
+        f"**Guild queue:** {METRICS.get_gauge('checks_waiting'):.0f} waiting, "
+        f"p95 wait under {METRICS.get_histogram('fair_wait_seconds').quantile(0.95)}s, "
+        f"{sum(METRICS.get_counters('fair_target_missed_total').values()):.0f} over the "
+        f"{FAIR_OPTIONS['latency_target']:.0f}s target\n"
+    )
+    output += (
+        f"**Diff:** mean {METRICS.get_histogram('diff_seconds').get_mean() * 1000:.0f} ms, "
+        f"**Save:** mean {METRICS.get_histogram('save_seconds').get_mean() * 1000:.0f} ms\n"
+    )
+    output += (
+        f"**Queued notifications:** {METRICS.get_gauge('notification_queue'):.0f}, "
+        f"**scheduled monitors:** {METRICS.get_gauge('monitors_scheduled'):.0f}, "
+        f"**hosts cooling down:** {METRICS.get_gauge('open_circuits'):.0f}\n"
+    )
+
+    hosts = sorted(
+        METRICS.get_histograms("fetch_seconds").items(),
+        key=lambda item: (item[1].quantile(0.95), item[1].get_mean()),
+        reverse=True,
+    )
+    if hosts:
+        output += "**Slowest hosts:**\n"
+        for labels, histogram in hosts[:10]:
+            output += (
+                f"* {dict(labels)['host']}: mean {histogram.get_mean() * 1000:.0f} ms, "
+                f"p95 under {histogram.quantile(0.95)}s, {histogram.get_count()} requests\n"
+            )
+    return output
+
+
+@client.tree.command(
+    description="Show how the bot is keeping up with the monitored websites",
+    nsfw=False,
+    auto_locale_strings=False,
+)
+@discord.app_commands.checks.has_permissions(administrator=True)
+async def stats(interaction: discord.Interaction):
+    await interaction.response.send_message(format_stats()[:2000], ephemeral=True)
+
+
+# The process pool re-imports this module in its workers, which must not start the bot
+if __name__ == "__main__":
+    tkn = os.environ.get("DISCORD_TOKEN")
 
-client.run(tkn)
+    client.run(tkn)